@@ -0,0 +1,133 @@
+import csv
+import hashlib
+import json
+import random
+
+
+class AnekdotDeck:
+    """Анекдоты в памяти процесса и перетасованная колода для каждого чата.
+
+    Анекдот не повторяется в чате, пока колода не закончится. Новые строки
+    таблицы подгружаются по id > max_id (database.refresh_anekdoty).
+    """
+
+    def __init__(self):
+        self.loaded = False
+        # id -> text
+        self.texts = {}
+        # хэши текстов для дедупликации при импорте
+        self.hashes = set()
+        self.max_id = 0
+        # chat_id -> оставшиеся id колоды (сдаём с конца)
+        self.decks = {}
+
+    def load(self, rows):
+        self.texts = {anekdot_id: text for anekdot_id, text in rows}
+        self.hashes = {anekdot_hash(text) for text in self.texts.values()}
+        self.max_id = max(self.texts, default=0)
+        self.decks = {}
+        self.loaded = True
+
+    def add(self, rows):
+        """Добавляет новые анекдоты и подмешивает их в уже розданные колоды"""
+        new_ids = []
+        for anekdot_id, text in rows:
+            self.texts[anekdot_id] = text
+            self.hashes.add(anekdot_hash(text))
+            self.max_id = max(self.max_id, anekdot_id)
+            new_ids.append(anekdot_id)
+        
+        if not new_ids:
+            return
+        # В колоде лежат только ещё не сданные id: дописываем новые разом и тасуем
+        # её один раз, а не вставляем по одному (O(n^2) на большом импорте)
+        for deck in self.decks.values():
+            deck.extend(new_ids)
+            random.shuffle(deck)
+
+    def deal(self, chat_id: int):
+        """Следующий анекдот для чата или None, если анекдотов нет"""
+        deck = self.decks.get(chat_id)
+
+        while True:
+            if not deck:
+                if not self.texts:
+                    return None
+                deck = list(self.texts)
+                random.shuffle(deck)
+                self.decks[chat_id] = deck
+
+            anekdot_id = deck.pop()
+            # id мог пропасть после перезагрузки таблицы
+            text = self.texts.get(anekdot_id)
+            if text is not None:
+                return text
+
+
+anekdot_deck = AnekdotDeck()
+
+
+def anekdot_hash(text: str) -> str:
+    """Хэш содержимого без учёта регистра и пробелов по краям/между словами"""
+    normalized = " ".join(text.split()).lower()
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+def parse_anekdoty(lines, file_name: str):
+    """Построчно разбирает файл импорта и отдаёт тексты анекдотов.
+
+    .txt - анекдоты разделены пустой строкой,
+    .csv - колонка text (или первая колонка без заголовка),
+    .json/.jsonl - JSON Lines: строка или объект с полем text.
+    """
+    name = file_name.lower()
+
+    if name.endswith(".csv"):
+        yield from _parse_csv(lines)
+    elif name.endswith((".json", ".jsonl")):
+        yield from _parse_jsonl(lines)
+    else:
+        yield from _parse_txt(lines)
+
+
+def _parse_txt(lines):
+    block = []
+    for line in lines:
+        line = line.rstrip()
+        if line:
+            block.append(line)
+        elif block:
+            yield "\n".join(block)
+            block = []
+    if block:
+        yield "\n".join(block)
+
+
+def _parse_csv(lines):
+    reader = csv.reader(lines)
+    column = 0
+    first = True
+    for row in reader:
+        if first:
+            first = False
+            header = [cell.strip().lower() for cell in row]
+            if "text" in header:
+                column = header.index("text")
+                continue
+        if len(row) > column and row[column].strip():
+            yield row[column].strip()
+
+
+def _parse_jsonl(lines):
+    for line in lines:
+        line = line.strip().rstrip(",")
+        if not line or line in ("[", "]"):
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(item, dict):
+            item = item.get("text")
+        if isinstance(item, str) and item.strip():
+            yield item.strip()
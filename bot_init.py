@@ -2,9 +2,12 @@ from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from config import TOKEN, TZ
+from sender import SendRateMiddleware
 
 # Инициализация бота и диспетчера
 bot = Bot(token=TOKEN)
+# Все исходящие сообщения идут через общий планировщик отправок
+bot.session.middleware(SendRateMiddleware())
 dp = Dispatcher(storage=MemoryStorage())
 scheduler = AsyncIOScheduler(timezone=TZ)
 
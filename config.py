@@ -16,8 +16,54 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
 
+# Пул соединений MySQL
+DB_POOL_MINSIZE = int(os.getenv("DB_POOL_MINSIZE", "2"))
+DB_POOL_MAXSIZE = int(os.getenv("DB_POOL_MAXSIZE", "10"))
+# Пересоздавать соединения старше N секунд (-1 - никогда)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", str(DB_POOL_MINSIZE)))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# Сколько ждать свободное соединение из пула
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))
+# Таймаут выполнения SELECT на сервере, мс (0 - без ограничения)
+DB_MAX_EXECUTION_TIME_MS = int(os.getenv("DB_MAX_EXECUTION_TIME_MS", "10000"))
+# Отладка: предупреждать, когда задача берёт второе соединение, не отдав первое
+DB_POOL_DEBUG = os.getenv("DB_POOL_DEBUG", "0") == "1"
+
 TZ = ZoneInfo("Asia/Omsk")
 
+# Кэш готовых текстов расписания (get_rasp_formatted)
+RASP_CACHE_SIZE = int(os.getenv("RASP_CACHE_SIZE", "512"))
+RASP_CACHE_TTL = int(os.getenv("RASP_CACHE_TTL", "600"))
+
+# Сколько чатов получают публикацию расписания одновременно
+PUBLISH_CONCURRENCY = int(os.getenv("PUBLISH_CONCURRENCY", "5"))
+# За сколько минут до времени публикации готовить тексты
+PRERENDER_MINUTES = int(os.getenv("PRERENDER_MINUTES", "5"))
+
+# Сколько пользователей держать в кэше никнеймов/подписей
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1000"))
+
+# Троттлинг входящих апдейтов: группа обработчиков -> (запас нажатий, пополнение в секунду).
+# Группа задаётся флагом flags={"throttling": "..."} у обработчика, без флага - "default"
+THROTTLING_RATES = {
+    "default": (5, 1.0),
+    "rasp": (3, 0.5),
+}
+# Общий лимит на групповой чат (все пользователи вместе)
+THROTTLING_CHAT_RATE = (20, 5.0)
+# Через сколько секунд простоя корзина пользователя/чата забывается
+THROTTLING_TTL = int(os.getenv("THROTTLING_TTL", "600"))
+
+# Лимиты исходящих сообщений (sender.py)
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_GROUP_PER_MINUTE = int(os.getenv("SEND_GROUP_PER_MINUTE", "20"))
+SEND_RETRY_ATTEMPTS = int(os.getenv("SEND_RETRY_ATTEMPTS", "3"))
+# Сколько чатов получают одну рассылку одновременно
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "5"))
+# Сколько секунд собирать части альбома (media group) перед пересылкой
+ALBUM_COLLECT_SECONDS = float(os.getenv("ALBUM_COLLECT_SECONDS", "1.0"))
+
 ssl_ctx = ssl.create_default_context()
 ssl_ctx.check_hostname = False
 ssl_ctx.verify_mode = ssl.CERT_NONE
@@ -4,291 +4,297 @@ import decimal
 import re
 import io
 from typing import List, Tuple, Dict, Optional
-from collections import defaultdict
+from collections import OrderedDict
 import time
 from config import *
+from rasp_model import rasp_model, format_rasp_day, split_subject_name, subject_entry
+from anekdoty import anekdot_deck, anekdot_hash
+from db_pool import create_pool, db_connection, db_transaction, shared_connection, after_commit
 
-# Глобальные переменные для управления флудом
-user_last_action = defaultdict(float)
-FLOOD_DELAY = 1.0
+# user_id -> (nickname, signature), LRU на USER_CACHE_SIZE записей
+user_profiles = OrderedDict()
 
 async def get_pool():
-    return await aiomysql.create_pool(
-        host=DB_HOST,
-        port=DB_PORT,
-        user=DB_USER,
-        password=DB_PASSWORD,
-        db=DB_NAME,
-        ssl=ssl_ctx,
-        autocommit=True
-    )
-
-async def init_db(pool):
-    async with pool.acquire() as conn:
+    return await create_pool()
+
+# Горячие запросы для проверки планов: (название, запрос, параметры)
+HOT_QUERIES = [
+    ("static_rasp: день",
+     "SELECT pair_number FROM static_rasp WHERE day=%s AND week_type=%s", (1, 1)),
+    ("static_rasp: неделя",
+     "SELECT day, pair_number FROM static_rasp WHERE week_type=%s", (1,)),
+    ("rasp_modifications: день чата",
+     "SELECT pair_number FROM rasp_modifications WHERE chat_id=%s AND day=%s AND week_type=%s", (0, 1, 1)),
+    ("rasp_modifications: неделя чата",
+     "SELECT day, pair_number FROM rasp_modifications WHERE chat_id=%s AND week_type=%s", (0, 1)),
+    ("rasp_modifications: день всех чатов",
+     "SELECT chat_id, pair_number FROM rasp_modifications WHERE day=%s AND week_type=%s AND chat_id IN (%s, %s)",
+     (1, 1, 0, 1)),
+    ("rasp_detailed: день чата",
+     "SELECT pair_number FROM rasp_detailed WHERE chat_id=%s AND day=%s AND week_type=%s", (0, 1, 1)),
+    ("rasp_detailed: чат",
+     "SELECT day, pair_number FROM rasp_detailed WHERE chat_id=%s", (0,)),
+    ("homework: на дату",
+     "SELECT id FROM homework WHERE due_date=%s", (datetime.date(2000, 1, 1),)),
+    ("homework: даты недели",
+     "SELECT DISTINCT due_date FROM homework WHERE due_date BETWEEN %s AND %s",
+     (datetime.date(2000, 1, 1), datetime.date(2000, 1, 7))),
+    ("birthdays: именинники",
+     "SELECT id FROM birthdays WHERE birth_md=%s", (101,)),
+    ("teacher_messages: последние",
+     "SELECT id FROM teacher_messages ORDER BY created_at DESC LIMIT 10", ()),
+]
+
+# ORDER BY ... LIMIT по индексу законно читает индекс с начала (type=index) и останавливается на LIMIT
+FULL_INDEX_SCAN_OK = {"teacher_messages: последние"}
+
+async def explain_hot_queries(pool):
+    """EXPLAIN горячих запросов: [(название, таблица, type, key)] для полных сканов таблицы (ALL) или индекса (index)"""
+    problems = []
+    async with db_connection(pool) as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cur:
+            for name, query, params in HOT_QUERIES:
+                await cur.execute("EXPLAIN " + query, params)
+                for row in await cur.fetchall():
+                    # type=NULL - ответ получен без чтения таблицы (например, пустой диапазон)
+                    access_type = row.get('type')
+                    if not row.get('table') or access_type not in ('ALL', 'index'):
+                        continue
+                    if access_type == 'index' and name in FULL_INDEX_SCAN_OK:
+                        continue
+                    problems.append((name, row['table'], access_type, row.get('key')))
+    return problems
+
+async def load_rasp_model(pool):
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
+            await cur.execute("SELECT day, week_type, pair_number, subject_id, cabinet FROM static_rasp ORDER BY id")
+            static_rows = await cur.fetchall()
+
             await cur.execute("""
-                CREATE TABLE IF NOT EXISTS rasp (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    chat_id BIGINT,
-                    day INT,
-                    week_type INT,
-                    text TEXT
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS birthdays (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    user_name VARCHAR(255) NOT NULL,
-                    birth_date DATE NOT NULL,
-                    added_by_user_id BIGINT,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS nicknames (
-                    user_id BIGINT PRIMARY KEY,
-                    nickname VARCHAR(255)
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS static_rasp (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    day INT,
-                    week_type INT,
-                    pair_number INT,
-                    subject_id INT,
-                    cabinet VARCHAR(50),
-                    FOREIGN KEY (subject_id) REFERENCES subjects(id)
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS rasp_modifications (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    chat_id BIGINT,
-                    day INT,
-                    week_type INT,
-                    pair_number INT,
-                    subject_id INT,
-                    cabinet VARCHAR(50),
-                    modified_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (subject_id) REFERENCES subjects(id)
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS publish_times (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    hour INT NOT NULL,
-                    minute INT NOT NULL
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS anekdoty (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    text TEXT NOT NULL
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS subjects (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    name VARCHAR(255) NOT NULL,
-                    rK BOOLEAN DEFAULT FALSE
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS special_users (
-                    user_id BIGINT PRIMARY KEY,
-                    signature VARCHAR(255) NOT NULL
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS rasp_detailed (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    chat_id BIGINT,
-                    day INT,
-                    week_type INT,
-                    pair_number INT,
-                    subject_id INT,
-                    cabinet VARCHAR(50),
-                    FOREIGN KEY (subject_id) REFERENCES subjects(id)
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS current_week_type (
-                    chat_id BIGINT PRIMARY KEY,
-                    week_type INT NOT NULL DEFAULT 1,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS teacher_messages (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    message_id BIGINT,
-                    from_user_id BIGINT,
-                    signature VARCHAR(255),
-                    message_text TEXT,
-                    message_type VARCHAR(50),
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS group_fund_balance (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    current_balance DECIMAL(10, 2) DEFAULT 0.00,
-                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS group_fund_members (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    full_name VARCHAR(255) NOT NULL,
-                    balance DECIMAL(10, 2) DEFAULT 0.00,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS group_fund_purchases (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    item_name VARCHAR(255) NOT NULL,
-                    item_url VARCHAR(500),
-                    price DECIMAL(10, 2) NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    is_active BOOLEAN DEFAULT TRUE
-                )""")
-            await cur.execute("""
-                CREATE TABLE IF NOT EXISTS homework (
-                    id INT AUTO_INCREMENT PRIMARY KEY,
-                    subject_id INT,
-                    due_date DATE,
-                    task_text TEXT NOT NULL,
-                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (subject_id) REFERENCES subjects(id)
-                )""")
-            await conn.commit()
-
-async def ensure_columns(pool):
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SHOW COLUMNS FROM week_setting LIKE 'set_at'")
-            row = await cur.fetchone()
-            if not row:
-                await cur.execute("ALTER TABLE week_setting ADD COLUMN set_at DATE")
+                SELECT chat_id, day, week_type, pair_number, subject_id, cabinet
+                FROM rasp_modifications
+                ORDER BY id
+            """)
+            modification_rows = await cur.fetchall()
+
+            await cur.execute("SELECT id, name, clean_name, default_cabinet FROM subjects")
+            subject_rows = await cur.fetchall()
 
-async def ensure_birthday_columns(pool):
-    async with pool.acquire() as conn:
+            await cur.execute("SELECT DISTINCT due_date FROM homework")
+            homework_dates = [row[0] for row in await cur.fetchall()]
+
+    rasp_model.load(static_rows, modification_rows, subject_rows, homework_dates)
+    # Полная перезагрузка (например, после /sql) - четность тоже перечитываем
+    _week_type_cache.clear()
+    print(f"✅ Расписание загружено в память: {len(static_rows)} статичных пар, "
+          f"{len(modification_rows)} модификаций, {len(subject_rows)} предметов (версия {rasp_model.version})")
+
+async def refresh_homework_dates(pool):
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SHOW COLUMNS FROM birthdays LIKE 'added_by_user_id'")
-            row = await cur.fetchone()
-            if not row:
-                await cur.execute("ALTER TABLE birthdays ADD COLUMN added_by_user_id BIGINT")
-                print("✅ Добавлена колонка added_by_user_id в таблицу birthdays")
+            await cur.execute("SELECT DISTINCT due_date FROM homework")
+            rows = await cur.fetchall()
+    dates = [row[0] for row in rows]
+    after_commit(lambda: rasp_model.set_homework_dates(dates))
 
-async def save_static_rasp(pool, day: int, week_type: int, pair_number: int, subject_id: int, cabinet: str):
-    async with pool.acquire() as conn:
+async def save_rasp_modifications(pool, chat_ids, day: int, week_type: int, pair_number: int, subject_id, cabinet,
+                                  save_static: bool = False) -> int:
+    """Одна и та же пара во всех chat_ids одним multi-row upsert (и в статике, если save_static).
+    
+    Стоимость не зависит от числа чатов: один-два запроса в одной транзакции.
+    Возвращает число записанных чатов.
+    """
+    chat_ids = list(chat_ids)
+    if not chat_ids and not save_static:
+        return 0
+    
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
-            await cur.execute("""
-                DELETE FROM static_rasp 
-                WHERE day=%s AND week_type=%s AND pair_number=%s
-            """, (day, week_type, pair_number))
+            if chat_ids:
+                placeholders = ",".join(["(%s, %s, %s, %s, %s, %s)"] * len(chat_ids))
+                params = []
+                for chat_id in chat_ids:
+                    params.extend((chat_id, day, week_type, pair_number, subject_id, cabinet))
+                await cur.execute(f"""
+                    INSERT INTO rasp_modifications (chat_id, day, week_type, pair_number, subject_id, cabinet)
+                    VALUES {placeholders}
+                    ON DUPLICATE KEY UPDATE subject_id=VALUES(subject_id), cabinet=VALUES(cabinet),
+                                            modified_at=CURRENT_TIMESTAMP
+                """, params)
             
-            await cur.execute("""
-                INSERT INTO static_rasp (day, week_type, pair_number, subject_id, cabinet)
-                VALUES (%s, %s, %s, %s, %s)
-            """, (day, week_type, pair_number, subject_id, cabinet))
+            if save_static:
+                await cur.execute("""
+                    INSERT INTO static_rasp (day, week_type, pair_number, subject_id, cabinet)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON DUPLICATE KEY UPDATE subject_id=VALUES(subject_id), cabinet=VALUES(cabinet)
+                """, (day, week_type, pair_number, subject_id, cabinet))
 
-async def get_static_rasp(pool, day: int, week_type: int):
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("""
-                SELECT DISTINCT sr.pair_number, s.name, sr.cabinet, sr.subject_id
-                FROM static_rasp sr
-                JOIN subjects s ON sr.subject_id = s.id
-                WHERE sr.day=%s AND sr.week_type=%s
-                ORDER BY sr.pair_number
-            """, (day, week_type))
-            return await cur.fetchall()
+    def update_model():
+        for chat_id in chat_ids:
+            rasp_model.set_modification(chat_id, day, week_type, pair_number, subject_id, cabinet)
+        if save_static:
+            rasp_model.set_static(day, week_type, pair_number, subject_id, cabinet)
+    
+    after_commit(update_model)
+    return len(chat_ids)
 
-async def save_rasp_modification(pool, chat_id: int, day: int, week_type: int, pair_number: int, subject_id: int, cabinet: str) -> bool:
-    try:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                print(f"🔍 DEBUG save_rasp_modification: чат={chat_id}, день={day}, неделя={week_type}, пара={pair_number}, subject_id={subject_id}, кабинет={cabinet}")
-                
-                await cur.execute("""
-                    DELETE FROM rasp_modifications 
-                    WHERE chat_id=%s AND day=%s AND week_type=%s AND pair_number=%s
-                """, (chat_id, day, week_type, pair_number))
-                
-                print(f"🔍 DEBUG: Удалено старых модификаций: {cur.rowcount}")
-                
-                await cur.execute("""
-                    INSERT INTO rasp_modifications (chat_id, day, week_type, pair_number, subject_id, cabinet)
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (chat_id, day, week_type, pair_number, subject_id, cabinet))
-                
-                print(f"✅ Модификация сохранена: чат={chat_id}, день={day}, неделя={week_type}, пара={pair_number}")
-                return True
-                
-    except Exception as e:
-        print(f"❌ Ошибка сохранения модификации: {e}")
-        return False
+async def set_detailed_cabinet(pool, chat_ids, day: int, week_type: int, pair_number: int, cabinet: str) -> int:
+    """Кабинет пары в rasp_detailed всех chat_ids одним upsert"""
+    chat_ids = list(chat_ids)
+    if not chat_ids:
+        return 0
+    
+    placeholders = ",".join(["(%s, %s, %s, %s, %s)"] * len(chat_ids))
+    params = []
+    for chat_id in chat_ids:
+        params.extend((chat_id, day, week_type, pair_number, cabinet))
+    
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(f"""
+                INSERT INTO rasp_detailed (chat_id, day, week_type, pair_number, cabinet)
+                VALUES {placeholders}
+                ON DUPLICATE KEY UPDATE cabinet=VALUES(cabinet)
+            """, params)
+    return len(chat_ids)
 
-async def get_rasp_modifications(pool, chat_id: int, day: int, week_type: int):
-    try:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                await cur.execute("""
-                    SELECT pair_number, subject_id, cabinet
-                    FROM rasp_modifications 
-                    WHERE chat_id=%s AND day=%s AND week_type=%s
-                    ORDER BY pair_number
-                """, (chat_id, day, week_type))
-                results = await cur.fetchall()
-                print(f"🔍 DEBUG: Найдено модификаций для чата {chat_id}, день {day}, неделя {week_type}: {len(results)}")
-                return results
-    except Exception as e:
-        print(f"❌ Ошибка получения модификаций: {e}")
-        return []
+async def clear_rasp_modifications(pool, week_type: int) -> dict:
+    """Модификации недели во всех чатах, включая уже удалённые из конфига"""
+    async with db_transaction(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("DELETE FROM rasp_modifications WHERE week_type=%s", (week_type,))
+            deleted_counts = {'modifications': cur.rowcount}
+    
+    after_commit(lambda: rasp_model.clear_modifications(week_type))
+    print(f"🧹 Очищено модификаций для недели {week_type}: {deleted_counts['modifications']} записей")
+    return deleted_counts
 
-async def clear_rasp_modifications(pool, week_type: int) -> int:
-    async with pool.acquire() as conn:
+async def clear_day_modifications(pool, week_type: int, day: int) -> dict:
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
-            total_cleared = 0
-            for chat_id in ALLOWED_CHAT_IDS:
-                await cur.execute("DELETE FROM rasp_modifications WHERE chat_id=%s AND week_type=%s", (chat_id, week_type))
-                total_cleared += cur.rowcount
-            
-            print(f"🧹 Очищено модификаций для недели {week_type}: {total_cleared} записей")
-            return total_cleared
+            await cur.execute("DELETE FROM rasp_modifications WHERE week_type=%s AND day=%s", (week_type, day))
+            deleted_counts = {'modifications': cur.rowcount}
+    
+    after_commit(lambda: rasp_model.clear_modifications(week_type, day=day))
+    return deleted_counts
 
-async def clear_day_modifications(pool, week_type: int, day: int) -> int:
-    async with pool.acquire() as conn:
+async def purge_orphan_chats(pool, chat_ids) -> dict:
+    """Удаляет модификации и детализированное расписание чатов, которых нет в chat_ids"""
+    chat_ids = list(chat_ids)
+    deleted_counts = {
+        'modifications': 0,
+        'rasp_detailed': 0
+    }
+    if not chat_ids:
+        # Пустой список - скорее ошибка конфига, чем "удалить всё"
+        return deleted_counts
+    
+    placeholders = ",".join(["%s"] * len(chat_ids))
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
-            total_cleared = 0
-            for chat_id in ALLOWED_CHAT_IDS:
-                await cur.execute("""
-                    DELETE FROM rasp_modifications 
-                    WHERE chat_id=%s AND week_type=%s AND day=%s
-                """, (chat_id, week_type, day))
-                total_cleared += cur.rowcount
+            await cur.execute(f"DELETE FROM rasp_modifications WHERE chat_id NOT IN ({placeholders})", chat_ids)
+            deleted_counts['modifications'] = cur.rowcount
             
-            return total_cleared
+            await cur.execute(f"DELETE FROM rasp_detailed WHERE chat_id NOT IN ({placeholders})", chat_ids)
+            deleted_counts['rasp_detailed'] = cur.rowcount
+    
+    if deleted_counts['modifications']:
+        after_commit(lambda: rasp_model.retain_chats(chat_ids))
+    return deleted_counts
 
-async def sync_rasp_to_all_chats(pool, source_chat_id: int):
+async def sync_rasp_to_all_chats(pool, source_chat_id: int) -> dict:
+    """Копирует rasp_detailed чата-источника во все остальные чаты одной транзакцией.
+    
+    Возвращает {chat_id: скопировано строк}; пустой словарь - нечего синхронизировать или ошибка.
+    """
+    target_chat_ids = [chat_id for chat_id in ALLOWED_CHAT_IDS if chat_id != source_chat_id]
+    if not target_chat_ids:
+        return {}
+    
+    placeholders = ",".join(["%s"] * len(target_chat_ids))
+    targets = " UNION ALL ".join(["SELECT %s AS chat_id"] * len(target_chat_ids))
+    
     try:
-        synced_count = 0
-        
-        async with pool.acquire() as conn:
+        async with db_transaction(pool) as conn:
             async with conn.cursor() as cur:
-                for chat_id in ALLOWED_CHAT_IDS:
-                    if chat_id == source_chat_id:
-                        continue
-                    
-                    await cur.execute("DELETE FROM rasp_detailed WHERE chat_id=%s", (chat_id,))
-                    
-                    await cur.execute("""
-                        INSERT INTO rasp_detailed (chat_id, day, week_type, pair_number, subject_id, cabinet)
-                        SELECT %s, day, week_type, pair_number, subject_id, cabinet 
-                        FROM rasp_detailed 
-                        WHERE chat_id=%s
-                    """, (chat_id, source_chat_id))
-                    
-                    synced_count += 1
-        
-        print(f"✅ Расписание синхронизировано! Обновлено {synced_count} чатов.")
-        return True
+                await cur.execute(f"DELETE FROM rasp_detailed WHERE chat_id IN ({placeholders})", target_chat_ids)
+                
+                await cur.execute(f"""
+                    INSERT INTO rasp_detailed (chat_id, day, week_type, pair_number, subject_id, cabinet)
+                    SELECT t.chat_id, r.day, r.week_type, r.pair_number, r.subject_id, r.cabinet
+                    FROM rasp_detailed r
+                    CROSS JOIN ({targets}) t
+                    WHERE r.chat_id=%s
+                """, (*target_chat_ids, source_chat_id))
+                # Каждый целевой чат получает одни и те же строки источника
+                copied_per_chat = cur.rowcount // len(target_chat_ids)
         
+        synced = {chat_id: copied_per_chat for chat_id in target_chat_ids}
+        print(f"✅ Расписание синхронизировано! Обновлено {len(synced)} чатов, по {copied_per_chat} пар в каждом.")
+        return synced
+    
     except Exception as e:
         print(f"❌ Ошибка синхронизации расписания: {e}")
-        return False
+        return {}
+
+async def load_anekdoty(pool):
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id, text FROM anekdoty")
+            rows = await cur.fetchall()
+    anekdot_deck.load(rows)
+    print(f"✅ Загружено анекдотов: {len(rows)}")
+
+async def refresh_anekdoty(pool) -> int:
+    """Подгружает только анекдоты, добавленные после последней загрузки"""
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT id, text FROM anekdoty WHERE id > %s ORDER BY id", (anekdot_deck.max_id,))
+            rows = await cur.fetchall()
+    anekdot_deck.add(rows)
+    return len(rows)
+
+async def import_anekdoty(pool, texts, batch_size: int = 1000) -> Dict[str, int]:
+    """Массовый импорт анекдотов: дедупликация по хэшу, вставка пачками в одной транзакции"""
+    if not anekdot_deck.loaded:
+        await load_anekdoty(pool)
+    
+    seen = set(anekdot_deck.hashes)
+    counts = {'added': 0, 'duplicates': 0}
+    
+    async with db_transaction(pool) as conn:
+        async with conn.cursor() as cur:
+            batch = []
+            for text in texts:
+                text_hash = anekdot_hash(text)
+                if text_hash in seen:
+                    counts['duplicates'] += 1
+                    continue
+                seen.add(text_hash)
+                batch.append((text,))
+                
+                if len(batch) >= batch_size:
+                    await cur.executemany("INSERT INTO anekdoty (text) VALUES (%s)", batch)
+                    counts['added'] += len(batch)
+                    batch = []
+            
+            if batch:
+                await cur.executemany("INSERT INTO anekdoty (text) VALUES (%s)", batch)
+                counts['added'] += len(batch)
+    
+    await refresh_anekdoty(pool)
+    print(f"✅ Импорт анекдотов: добавлено {counts['added']}, дубликатов {counts['duplicates']}")
+    return counts
+
+async def get_anekdot(pool, chat_id: int) -> Optional[str]:
+    if not anekdot_deck.loaded:
+        await load_anekdoty(pool)
+    return anekdot_deck.deal(chat_id)
+
 
 async def get_fund_balance(pool) -> float:
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT current_balance FROM group_fund_balance ORDER BY id DESC LIMIT 1")
             row = await cur.fetchone()
@@ -302,19 +308,20 @@ async def get_fund_balance(pool) -> float:
                 return 0.0
 
 async def update_fund_balance(pool, amount: float):
-    async with pool.acquire() as conn:
+    # get_fund_balance читает через то же соединение транзакции
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
             current_balance = await get_fund_balance(pool)
             new_balance = current_balance + amount
             await cur.execute("INSERT INTO group_fund_balance (current_balance) VALUES (%s)", (new_balance,))
 
 async def add_fund_member(pool, full_name: str):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("INSERT INTO group_fund_members (full_name) VALUES (%s)", (full_name,))
 
 async def get_all_fund_members(pool):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT id, full_name, balance FROM group_fund_members ORDER BY full_name")
             rows = await cur.fetchall()
@@ -331,18 +338,18 @@ async def get_all_fund_members(pool):
             return result
 
 async def delete_fund_member(pool, member_id: int):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("DELETE FROM group_fund_members WHERE id = %s", (member_id,))
 
 async def update_member_balance(pool, member_id: int, amount: float):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             amount_decimal = decimal.Decimal(str(amount))
             await cur.execute("UPDATE group_fund_members SET balance = balance + %s WHERE id = %s", (amount_decimal, member_id))
 
 async def add_purchase(pool, item_name: str, item_url: str, price: float):
-    async with pool.acquire() as conn:
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute(
                 "INSERT INTO group_fund_purchases (item_name, item_url, price) VALUES (%s, %s, %s)",
@@ -351,13 +358,13 @@ async def add_purchase(pool, item_name: str, item_url: str, price: float):
             await update_fund_balance(pool, -price)
 
 async def get_all_purchases(pool):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT id, item_name, item_url, price FROM group_fund_purchases WHERE is_active = TRUE ORDER BY created_at DESC")
             return await cur.fetchall()
 
 async def delete_purchase(pool, purchase_id: int):
-    async with pool.acquire() as conn:
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT price FROM group_fund_purchases WHERE id = %s", (purchase_id,))
             row = await cur.fetchone()
@@ -372,15 +379,17 @@ async def add_homework(pool, subject_id: int, due_date: str, task_text: str):
     except ValueError:
         raise ValueError("Неверный формат даты. Используйте ДД.ММ.ГГГГ")
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 INSERT INTO homework (subject_id, due_date, task_text)
                 VALUES (%s, %s, %s)
             """, (subject_id, due_date_mysql, task_text))
+    
+    await refresh_homework_dates(pool)
 
 async def get_all_homework(pool, limit: int = 50) -> List[Tuple]:
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 SELECT h.id, s.name, h.due_date, h.task_text, h.created_at
@@ -398,7 +407,7 @@ async def get_homework_by_date(pool, date: str) -> List[Tuple]:
         except ValueError:
             return []
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 SELECT h.id, s.name, h.due_date, h.task_text, h.created_at
@@ -410,7 +419,7 @@ async def get_homework_by_date(pool, date: str) -> List[Tuple]:
             return await cur.fetchall()
 
 async def get_homework_by_id(pool, homework_id: int) -> Tuple:
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 SELECT h.id, s.name, h.due_date, h.task_text, h.created_at, h.subject_id
@@ -438,76 +447,90 @@ async def update_homework(pool, homework_id: int, subject_id: int, due_date: str
     else:
         due_date_mysql = due_date
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 UPDATE homework 
                 SET subject_id=%s, due_date=%s, task_text=%s
                 WHERE id=%s
             """, (subject_id, due_date_mysql, task_text, homework_id))
+    
+    await refresh_homework_dates(pool)
 
 async def delete_homework(pool, homework_id: int):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("DELETE FROM homework WHERE id=%s", (homework_id,))
+    
+    await refresh_homework_dates(pool)
 
-async def has_homework_for_date(pool, date: str) -> bool:
-    if '.' in date:
-        try:
-            date = datetime.datetime.strptime(date, '%d.%m.%Y').strftime('%Y-%m-%d')
-        except ValueError:
-            return False
+def _remember_user_profile(user_id: int, nickname, signature):
+    user_profiles[user_id] = (nickname, signature)
+    user_profiles.move_to_end(user_id)
+    while len(user_profiles) > USER_CACHE_SIZE:
+        user_profiles.popitem(last=False)
+
+async def get_user_profile(pool, user_id: int):
+    """(nickname, signature) пользователя: из кэша или одним запросом"""
+    profile = user_profiles.get(user_id)
+    if profile is not None:
+        user_profiles.move_to_end(user_id)
+        return profile
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SELECT COUNT(*) FROM homework WHERE due_date=%s", (date,))
-            result = await cur.fetchone()
-            return result[0] > 0 if result else False
+            await cur.execute("""
+                SELECT (SELECT nickname FROM nicknames WHERE user_id=%s),
+                       (SELECT signature FROM special_users WHERE user_id=%s)
+            """, (user_id, user_id))
+            nickname, signature = await cur.fetchone()
+    
+    _remember_user_profile(user_id, nickname, signature)
+    return nickname, signature
 
 async def set_nickname(pool, user_id: int, nickname: str):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 INSERT INTO nicknames (user_id, nickname) 
                 VALUES (%s, %s)
                 ON DUPLICATE KEY UPDATE nickname=%s
             """, (user_id, nickname, nickname))
+    
+    if user_id in user_profiles:
+        _remember_user_profile(user_id, nickname, user_profiles[user_id][1])
 
 async def get_nickname(pool, user_id: int) -> str | None:
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT nickname FROM nicknames WHERE user_id=%s", (user_id,))
-            row = await cur.fetchone()
-            return row[0] if row else None
+    nickname, _ = await get_user_profile(pool, user_id)
+    return nickname
 
 async def add_publish_time(pool, hour: int, minute: int):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute(
                 "INSERT INTO publish_times (hour, minute) VALUES (%s, %s)", 
                 (hour, minute)
             )
-            await conn.commit()
 
 async def get_publish_times(pool):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT id, hour, minute FROM publish_times ORDER BY hour, minute")
             return await cur.fetchall()
 
 async def delete_publish_time(pool, pid: int):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("DELETE FROM publish_times WHERE id=%s", (pid,))
 
 async def clear_publish_times(pool):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("DELETE FROM publish_times")
 
 async def set_week_type(pool, chat_id, week_type):
     today = datetime.datetime.now(TZ).date()
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 INSERT INTO week_setting (chat_id, week_type, set_at)
@@ -517,79 +540,165 @@ async def set_week_type(pool, chat_id, week_type):
 
 async def load_special_users(pool):
     global SPECIAL_USER_ID
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT user_id FROM special_users")
             rows = await cur.fetchall()
             SPECIAL_USER_ID = [row[0] for row in rows]
     print(f"Загружено {len(SPECIAL_USER_ID)} спец-пользователей: {SPECIAL_USER_ID}")
 
-async def get_current_week_type(pool, chat_id: int = None) -> int:
+# Четность на текущий календарный день: {"date": ..., "week_type": ...}
+_week_type_cache = {}
+
+def week_type_for_date(anchor_week_type: int, anchor_date: datetime.date, date: datetime.date) -> int:
+    """Четность недели, в которую попадает date, если неделя anchor_date имела четность anchor_week_type"""
+    anchor_monday = anchor_date - datetime.timedelta(days=anchor_date.isoweekday() - 1)
+    monday = date - datetime.timedelta(days=date.isoweekday() - 1)
+    weeks = (monday - anchor_monday).days // 7
+    if weeks % 2 == 0:
+        return anchor_week_type
+    return 2 if anchor_week_type == 1 else 1
+
+async def get_week_anchor(pool):
+    """Опорная точка четности: (week_type, date) или None"""
     COMMON_CHAT_ID = 0
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT week_type, updated_at FROM current_week_type WHERE chat_id=%s", (COMMON_CHAT_ID,))
             row = await cur.fetchone()
-            
-            now = datetime.datetime.now(TZ)
-            today = now.date()
-            current_weekday = today.isoweekday()
-            
-            if row:
-                week_type, last_updated = row
-                
-                if isinstance(last_updated, datetime.datetime):
-                    last_updated_date = last_updated.date()
-                else:
-                    last_updated_date = last_updated
-                
-                if current_weekday == 1:
-                    this_monday = today
-                    
-                    if last_updated_date < this_monday:
-                        previous_week = week_type
-                        week_type = 2 if week_type == 1 else 1
-                        
-                        await cur.execute("""
-                            UPDATE current_week_type 
-                            SET week_type=%s, updated_at=%s 
-                            WHERE chat_id=%s
-                        """, (week_type, today, COMMON_CHAT_ID))
-                        
-                        await clear_rasp_modifications(pool, previous_week)
-                        print(f"✅ Автоматически переключена неделя на: {'нечетная' if week_type == 1 else 'четная'}")
-                        print(f"✅ Сброшены модификации для предыдущей недели {previous_week}")
-                
-                return week_type
-            else:
-                week_type = 1
-                await cur.execute("INSERT INTO current_week_type (chat_id, week_type, updated_at) VALUES (%s, %s, %s)", 
-                                 (COMMON_CHAT_ID, week_type, today))
-                return week_type
+    
+    if not row:
+        return None
+    
+    week_type, updated_at = row
+    if isinstance(updated_at, datetime.datetime):
+        updated_at = updated_at.date()
+    return week_type, updated_at
+
+async def get_current_week_type(pool, chat_id: int = None) -> int:
+    today = datetime.datetime.now(TZ).date()
+    if _week_type_cache.get("date") == today:
+        return _week_type_cache["week_type"]
+    
+    anchor = await get_week_anchor(pool)
+    week_type = week_type_for_date(*anchor, today) if anchor else 1
+    
+    _week_type_cache["date"] = today
+    _week_type_cache["week_type"] = week_type
+    return week_type
+
+async def rollover_week_type(pool) -> int:
+    """Переносит опорную точку четности на текущую неделю и сбрасывает модификации прошедшей.
+    
+    Повторный запуск в ту же неделю ничего не делает.
+    """
+    COMMON_CHAT_ID = 0
+    today = datetime.datetime.now(TZ).date()
+    this_monday = today - datetime.timedelta(days=today.isoweekday() - 1)
+    
+    anchor = await get_week_anchor(pool)
+    if anchor is None:
+        async with db_connection(pool) as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("INSERT INTO current_week_type (chat_id, week_type, updated_at) VALUES (%s, %s, %s)",
+                                  (COMMON_CHAT_ID, 1, today))
+        _week_type_cache.clear()
+        return 1
+    
+    anchor_week_type, anchor_date = anchor
+    week_type = week_type_for_date(anchor_week_type, anchor_date, today)
+    
+    if anchor_date >= this_monday:
+        return week_type
+    
+    previous_week = 2 if week_type == 1 else 1
+    
+    # Перенос опоры и сброс модификаций - вместе: если сброс упадёт, опора останется
+    # в прошлой неделе и следующий запуск повторит всё целиком
+    async with db_transaction(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                UPDATE current_week_type
+                SET week_type=%s, updated_at=%s
+                WHERE chat_id=%s
+            """, (week_type, today, COMMON_CHAT_ID))
+        
+        await clear_rasp_modifications(pool, previous_week)
+        after_commit(_week_type_cache.clear)
+    
+    print(f"✅ Неделя переключена на: {'нечетная' if week_type == 1 else 'четная'}")
+    print(f"✅ Сброшены модификации для предыдущей недели {previous_week}")
+    return week_type
 
 async def set_current_week_type(pool, chat_id: int = None, week_type: int = None):
     COMMON_CHAT_ID = 0
+    # Дата опоры - по TZ, а не по часам сервера БД: иначе ночью в понедельник
+    # опора попадёт в воскресенье и четность перевернётся
+    today = datetime.datetime.now(TZ).date()
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
-                INSERT INTO current_week_type (chat_id, week_type) 
-                VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE week_type=%s, updated_at=CURRENT_TIMESTAMP
-            """, (COMMON_CHAT_ID, week_type, week_type))
+                INSERT INTO current_week_type (chat_id, week_type, updated_at)
+                VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE week_type=%s, updated_at=%s
+            """, (COMMON_CHAT_ID, week_type, today, week_type, today))
+    
+    _week_type_cache.clear()
+    # Заранее подготовленные публикации содержат четность - они устарели
+    rasp_model.touch()
 
 async def save_teacher_message(pool, message_id: int, from_user_id: int, 
-                              signature: str, message_text: str, message_type: str):
-    async with pool.acquire() as conn:
+                              signature: str, message_text: str, message_type: str,
+                              deliveries: dict = None) -> int:
+    """Сохраняет сообщение и где оно опубликовано: deliveries = {chat_id: message_id или [message_id, ...]}"""
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 INSERT INTO teacher_messages (message_id, from_user_id, signature, message_text, message_type)
                 VALUES (%s, %s, %s, %s, %s)
             """, (message_id, from_user_id, signature, message_text, message_type))
+            teacher_message_id = cur.lastrowid
+            
+            rows = []
+            for chat_id, chat_message_ids in (deliveries or {}).items():
+                if not isinstance(chat_message_ids, list):
+                    chat_message_ids = [chat_message_ids]
+                rows.extend((teacher_message_id, chat_id, chat_message_id) for chat_message_id in chat_message_ids)
+            
+            if rows:
+                await cur.executemany("""
+                    INSERT INTO teacher_message_deliveries (teacher_message_id, chat_id, message_id)
+                    VALUES (%s, %s, %s)
+                """, rows)
+    
+    return teacher_message_id
+
+async def get_teacher_message_deliveries(pool, teacher_message_id: int) -> Dict[int, List[int]]:
+    """{chat_id: [message_id, ...]} по возрастанию id (у альбома первым идёт элемент с подписью)"""
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT chat_id, message_id FROM teacher_message_deliveries
+                WHERE teacher_message_id = %s
+                ORDER BY chat_id, message_id
+            """, (teacher_message_id,))
+            rows = await cur.fetchall()
+    
+    deliveries = {}
+    for chat_id, message_id in rows:
+        deliveries.setdefault(chat_id, []).append(message_id)
+    return deliveries
+
+async def update_teacher_message_text(pool, teacher_message_id: int, message_text: str):
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("UPDATE teacher_messages SET message_text = %s WHERE id = %s",
+                              (message_text, teacher_message_id))
 
 async def get_teacher_messages(pool, offset: int = 0, limit: int = 10) -> List[Tuple]:
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 SELECT id, message_id, signature, message_text, message_type, created_at
@@ -600,7 +709,7 @@ async def get_teacher_messages(pool, offset: int = 0, limit: int = 10) -> List[T
             return await cur.fetchall()
 
 async def get_teacher_messages_count(pool) -> int:
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("SELECT COUNT(*) FROM teacher_messages")
             result = await cur.fetchone()
@@ -612,7 +721,7 @@ async def add_birthday(pool, user_name: str, birth_date: str, added_by_user_id:
     except ValueError:
         raise ValueError("Неверный формат даты. Используйте ДД.ММ.ГГГГ")
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 INSERT INTO birthdays (user_name, birth_date, added_by_user_id)
@@ -622,16 +731,17 @@ async def add_birthday(pool, user_name: str, birth_date: str, added_by_user_id:
 async def get_today_birthdays(pool):
     today = datetime.datetime.now(TZ).date()
     today_str = today.strftime('%m-%d')
+    today_md = today.month * 100 + today.day
     
     print(f"🔍 Проверяем дни рождения на дату: {today_str}")
     
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 SELECT id, user_name, birth_date
                 FROM birthdays 
-                WHERE DATE_FORMAT(birth_date, '%%m-%%d') = %s
-            """, (today_str,))
+                WHERE birth_md = %s
+            """, (today_md,))
             results = await cur.fetchall()
             
             print(f"📅 Найдено дней рождений: {len(results)}")
@@ -641,12 +751,12 @@ async def get_today_birthdays(pool):
             return results
 
 async def get_all_birthdays(pool):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 SELECT id, user_name, birth_date, added_by_user_id, created_at
                 FROM birthdays 
-                ORDER BY DATE_FORMAT(birth_date, '%m-%d')
+                ORDER BY birth_md
             """)
             return await cur.fetchall()
 
@@ -667,31 +777,31 @@ async def format_birthday_footer(pool):
         return f"\n\n🎉 Сегодня у {count} человек День рождения\nСчастливчики: {names_str}"
 
 async def delete_birthday(pool, birthday_id: int):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("DELETE FROM birthdays WHERE id=%s", (birthday_id,))
 
 async def get_special_user_signature(pool, user_id: int) -> str | None:
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT signature FROM special_users WHERE user_id=%s", (user_id,))
-            row = await cur.fetchone()
-            return row[0] if row else None
+    _, signature = await get_user_profile(pool, user_id)
+    return signature
 
 async def set_special_user_signature(pool, user_id: int, signature: str):
-    async with pool.acquire() as conn:
+    async with db_connection(pool) as conn:
         async with conn.cursor() as cur:
             await cur.execute("""
                 INSERT INTO special_users (user_id, signature) 
                 VALUES (%s, %s)
                 ON DUPLICATE KEY UPDATE signature=%s
             """, (user_id, signature, signature))
+    
+    if user_id in user_profiles:
+        _remember_user_profile(user_id, user_profiles[user_id][0], signature)
 
 async def delete_teacher_message(pool, message_id: int) -> bool:
-    async with pool.acquire() as conn:
+    async with db_transaction(pool) as conn:
         async with conn.cursor() as cur:
+            await cur.execute("DELETE FROM teacher_message_deliveries WHERE teacher_message_id = %s", (message_id,))
             await cur.execute("DELETE FROM teacher_messages WHERE id = %s", (message_id,))
-            await conn.commit()
             return cur.rowcount > 0
 
 async def reset_week_schedule(pool, week_type: int) -> dict:
@@ -702,22 +812,19 @@ async def reset_week_schedule(pool, week_type: int) -> dict:
     }
     
     try:
-        async with pool.acquire() as conn:
+        async with db_transaction(pool) as conn:
             async with conn.cursor() as cur:
-                for chat_id in ALLOWED_CHAT_IDS:
-                    await cur.execute("DELETE FROM rasp_modifications WHERE chat_id=%s AND week_type=%s", 
-                                    (chat_id, week_type))
-                    deleted_counts['modifications'] += cur.rowcount
+                await cur.execute("DELETE FROM rasp_modifications WHERE week_type=%s", (week_type,))
+                deleted_counts['modifications'] = cur.rowcount
                 
                 await cur.execute("DELETE FROM static_rasp WHERE week_type=%s", (week_type,))
                 deleted_counts['static_rasp'] = cur.rowcount
                 
-                for chat_id in ALLOWED_CHAT_IDS:
-                    await cur.execute("DELETE FROM rasp_detailed WHERE chat_id=%s AND week_type=%s", 
-                                    (chat_id, week_type))
-                    deleted_counts['rasp_detailed'] += cur.rowcount
-                
-                await conn.commit()
+                await cur.execute("DELETE FROM rasp_detailed WHERE week_type=%s", (week_type,))
+                deleted_counts['rasp_detailed'] = cur.rowcount
+        
+        after_commit(lambda: rasp_model.clear_modifications(week_type))
+        after_commit(lambda: rasp_model.clear_static(week_type))
         
         week_name = "нечетной" if week_type == 1 else "четной"
         print(f"✅ Сброшено всё расписание для {week_name} недели: "
@@ -732,73 +839,49 @@ async def reset_week_schedule(pool, week_type: int) -> dict:
         return deleted_counts
 
 async def initialize_static_rasp_from_current(pool, week_type: int):
-    print(f"🔧 Начинаю сохранение недели {week_type}")
+    if not ALLOWED_CHAT_IDS:
+        print("❌ Нет разрешенных чатов для инициализации статичного расписания")
+        return False
+    
+    main_chat_id = ALLOWED_CHAT_IDS[0]
     
     try:
-        async with pool.acquire() as conn:
+        async with db_transaction(pool) as conn:
             async with conn.cursor() as cur:
                 await cur.execute("DELETE FROM static_rasp WHERE week_type=%s", (week_type,))
-        
-        if ALLOWED_CHAT_IDS:
-            main_chat_id = ALLOWED_CHAT_IDS[0]
-            
-            for day in range(1, 7):
-                print(f"🔍 Обработка дня {day} (неделя {week_type})...")
-                
-                async with pool.acquire() as conn:
-                    async with conn.cursor() as cur:
-                        await cur.execute("""
-                            SELECT pair_number, subject_id, cabinet 
-                            FROM rasp_detailed 
-                            WHERE chat_id=%s AND day=%s AND week_type=%s
-                            ORDER BY pair_number
-                        """, (main_chat_id, day, week_type))
-                        static_rasp = await cur.fetchall()
-                
-                async with pool.acquire() as conn:
-                    async with conn.cursor() as cur:
-                        await cur.execute("""
-                            SELECT pair_number, subject_id, cabinet
-                            FROM rasp_modifications 
-                            WHERE chat_id=%s AND day=%s AND week_type=%s
-                            ORDER BY pair_number
-                        """, (main_chat_id, day, week_type))
-                        modifications = await cur.fetchall()
-                
-                print(f"  Статических пар: {len(static_rasp)}")
-                print(f"  Модификаций: {len(modifications)}")
                 
-                mod_dict = {pair_num: (subj_id, cabinet) for pair_num, subj_id, cabinet in modifications}
+                # Модификация главного чата перекрывает rasp_detailed целиком: очищенная пара
+                # (subject_id NULL) не берёт предмет из rasp_detailed, а просто не сохраняется
+                await cur.execute("""
+                    INSERT INTO static_rasp (day, week_type, pair_number, subject_id, cabinet)
+                    SELECT p.day, %s, p.pair_number,
+                           IF(m.id IS NULL, d.subject_id, m.subject_id),
+                           COALESCE(IF(m.id IS NULL, d.cabinet, m.cabinet), 'Не указан')
+                    FROM (
+                        SELECT day, pair_number FROM rasp_detailed WHERE chat_id=%s AND week_type=%s
+                        UNION
+                        SELECT day, pair_number FROM rasp_modifications WHERE chat_id=%s AND week_type=%s
+                    ) p
+                    LEFT JOIN rasp_detailed d
+                        ON d.chat_id=%s AND d.week_type=%s AND d.day=p.day AND d.pair_number=p.pair_number
+                    LEFT JOIN rasp_modifications m
+                        ON m.chat_id=%s AND m.week_type=%s AND m.day=p.day AND m.pair_number=p.pair_number
+                    WHERE p.day BETWEEN 1 AND 6 AND p.pair_number BETWEEN 1 AND 6
+                      AND IF(m.id IS NULL, d.subject_id, m.subject_id) IS NOT NULL
+                """, (week_type, main_chat_id, week_type, main_chat_id, week_type,
+                      main_chat_id, week_type, main_chat_id, week_type))
+                saved_count = cur.rowcount
                 
-                for pair_num in range(1, 7):
-                    if pair_num in mod_dict:
-                        subject_id, cabinet = mod_dict[pair_num]
-                        print(f"  Пара {pair_num}: используем модификацию (subject_id={subject_id})")
-                    else:
-                        found = False
-                        for static_pair_num, static_subject_id, static_cabinet in static_rasp:
-                            if static_pair_num == pair_num:
-                                subject_id = static_subject_id
-                                cabinet = static_cabinet
-                                found = True
-                                print(f"  Пара {pair_num}: используем статику (subject_id={subject_id})")
-                                break
-                        
-                        if not found:
-                            print(f"  Пара {pair_num}: не существует, пропускаем")
-                            continue
-                    
-                    if subject_id:
-                        await save_static_rasp(pool, day, week_type, pair_num, subject_id, cabinet or "Не указан")
-                        print(f"  ✅ Сохранена пара {pair_num}: день={day}, subject_id={subject_id}")
-                    else:
-                        print(f"  Пара {pair_num}: очищена (subject_id=None), не сохраняем")
-            
-            print(f"✅ Статичное расписание для недели {week_type} инициализировано")
-            return True
-        else:
-            print("❌ Нет разрешенных чатов для инициализации статичного расписания")
-            return False
+                await cur.execute("""
+                    SELECT day, pair_number, subject_id, cabinet
+                    FROM static_rasp
+                    WHERE week_type=%s
+                """, (week_type,))
+                rows = await cur.fetchall()
+        
+        after_commit(lambda: rasp_model.replace_static_week(week_type, rows))
+        print(f"✅ Статичное расписание для недели {week_type} инициализировано: {saved_count} пар")
+        return True
         
     except Exception as e:
         print(f"❌ Ошибка при инициализации статичного расписания: {e}")
@@ -806,107 +889,208 @@ async def initialize_static_rasp_from_current(pool, week_type: int):
         traceback.print_exc()
         return False
 
-async def get_rasp_formatted(day, week_type, chat_id: int = None, target_date: datetime.date = None):
+async def resolve_rasp_day(pool, chat_id: int, day: int, week_type: int, target_date: datetime.date):
+    """Статика, модификации чата, названия предметов и флаг ДЗ одним запросом"""
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT p.pair_number,
+                       sr.subject_id, sr.cabinet, ss.name, ss.clean_name, ss.default_cabinet,
+                       m.id IS NOT NULL, m.subject_id, m.cabinet, ms.name, ms.clean_name, ms.default_cabinet,
+                       EXISTS(SELECT 1 FROM homework WHERE due_date=%s)
+                FROM (
+                    SELECT pair_number FROM static_rasp WHERE day=%s AND week_type=%s
+                    UNION
+                    SELECT pair_number FROM rasp_modifications WHERE chat_id=%s AND day=%s AND week_type=%s
+                ) p
+                LEFT JOIN static_rasp sr
+                    ON sr.day=%s AND sr.week_type=%s AND sr.pair_number=p.pair_number
+                LEFT JOIN subjects ss ON ss.id=sr.subject_id
+                LEFT JOIN rasp_modifications m
+                    ON m.chat_id=%s AND m.day=%s AND m.week_type=%s AND m.pair_number=p.pair_number
+                LEFT JOIN subjects ms ON ms.id=m.subject_id
+                ORDER BY p.pair_number, sr.id, m.id
+            """, (target_date, day, week_type, chat_id, day, week_type,
+                  day, week_type, chat_id, day, week_type))
+            rows = await cur.fetchall()
+    
+    static_pairs = {}
+    modified_pairs = {}
+    subjects = {}
+    has_hw = bool(rows[0][-1]) if rows else False
+    
+    for row in rows:
+        pair_number = row[0]
+        static_subject_id, static_cabinet, static_name, static_clean, static_default = row[1:6]
+        is_modified, mod_subject_id, mod_cabinet, mod_name, mod_clean, mod_default = row[6:12]
+        
+        if static_name is not None:
+            static_pairs[pair_number] = (static_subject_id, static_cabinet)
+            subjects[static_subject_id] = subject_entry(static_name, static_clean, static_default)
+        if is_modified:
+            modified_pairs[pair_number] = (mod_subject_id, mod_cabinet)
+            if mod_name is not None:
+                subjects[mod_subject_id] = subject_entry(mod_name, mod_clean, mod_default)
+    
+    return static_pairs, modified_pairs, subjects, has_hw
+
+async def get_rasp_formatted(day, week_type, chat_id: int = None, target_date: datetime.date = None, pool=None):
     if chat_id is None:
         chat_id = ALLOWED_CHAT_IDS[0] if ALLOWED_CHAT_IDS else DEFAULT_CHAT_ID
     
-    msg_lines = []
+    if target_date is None:
+        target_date = datetime.datetime.now(TZ).date()
     
-    static_rasp = await get_static_rasp(pool, day, week_type)
-    static_pairs = {row[0]: (row[1], row[2], row[3]) for row in static_rasp}
+    cache_key = (chat_id, day, week_type, target_date)
+    cached = rasp_model.render_cache.get(cache_key)
+    if cached is not None:
+        return cached
     
-    modifications = await get_rasp_modifications(pool, chat_id, day, week_type)
-    modified_pairs = {row[0]: (row[1], row[2]) for row in modifications}
-
-    max_pair = 0
-    all_pairs = set(static_pairs.keys()) | set(modified_pairs.keys())
-    if all_pairs:
-        max_pair = max(all_pairs)
+    if rasp_model.loaded:
+        # Всё берём из модели в памяти, без запросов к БД
+        static_pairs, modified_pairs = rasp_model.get_day(chat_id, day, week_type)
+        subjects = rasp_model.subjects
+        has_hw = rasp_model.has_homework(target_date)
+    else:
+        # Модель ещё не загружена - собираем день одним запросом
+        static_pairs, modified_pairs, subjects, has_hw = await resolve_rasp_day(pool, chat_id, day, week_type, target_date)
     
-    if max_pair == 0:
-        result = "Расписание пустое."
+    text = format_rasp_day(static_pairs, modified_pairs, subjects, has_hw)
+    rasp_model.render_cache.put(cache_key, text)
+    return text
+
+async def group_chats_by_overlay(pool, chat_ids, day: int, week_type: int):
+    """Группирует чаты с одинаковыми модификациями дня. Возвращает список списков chat_id"""
+    if rasp_model.loaded:
+        overlays = {
+            chat_id: rasp_model.get_day(chat_id, day, week_type)[1]
+            for chat_id in chat_ids
+        }
     else:
-        has_modifications = False
-        
-        for i in range(1, max_pair + 1):
-            line = ""
+        overlays = {chat_id: {} for chat_id in chat_ids}
+        if chat_ids:
+            placeholders = ",".join(["%s"] * len(chat_ids))
+            async with db_connection(pool) as conn:
+                async with conn.cursor() as cur:
+                    await cur.execute(f"""
+                        SELECT chat_id, pair_number, subject_id, cabinet
+                        FROM rasp_modifications
+                        WHERE day=%s AND week_type=%s AND chat_id IN ({placeholders})
+                        ORDER BY id
+                    """, (day, week_type, *chat_ids))
+                    for chat_id, pair_number, subject_id, cabinet in await cur.fetchall():
+                        overlays[chat_id][pair_number] = (subject_id, cabinet)
+    
+    groups = {}
+    for chat_id in chat_ids:
+        key = tuple(sorted(overlays[chat_id].items()))
+        groups.setdefault(key, []).append(chat_id)
+    
+    return list(groups.values())
+
+async def resolve_rasp_week(pool, chat_id: int, week_type: int, date_from: datetime.date, date_to: datetime.date):
+    """Статика, модификации чата, предметы и даты ДЗ сразу на всю неделю"""
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT day, pair_number, subject_id, cabinet
+                FROM static_rasp
+                WHERE week_type=%s
+                ORDER BY id
+            """, (week_type,))
+            static_rows = await cur.fetchall()
             
-            if i in modified_pairs:
-                subject_id, cabinet = modified_pairs[i]
-                
-                if subject_id is None or subject_id == 0:
-                    line = f"{i}. Свободно 🔄"
-                    has_modifications = True
-                else:
-                    async with pool.acquire() as conn:
-                        async with conn.cursor() as cur:
-                            await cur.execute("SELECT name FROM subjects WHERE id=%s", (subject_id,))
-                            subject_row = await cur.fetchone()
-                            subject_name = subject_row[0] if subject_row else "Свободно"
-                    
-                    if subject_name == "Свободно":
-                        line = f"{i}. Свободно 🔄"
-                    else:
-                        import re
-                        clean_subject_name = re.sub(r'\s+(\d+\.?\d*[а-я]?|\d+\.?\d*/\d+\.?\d*|сп/з|актовый зал|спортзал)$', '', subject_name).strip()
-                        
-                        if cabinet and cabinet != "Не указан":
-                            line = f"{i}. {cabinet} {clean_subject_name} 🔄"
-                        else:
-                            cabinet_match = re.search(r'(\s+)(\d+\.?\d*[а-я]?|\d+\.?\d*/\d+\.?\d*|сп/з|актовый зал|спортзал)$', subject_name)
-                            if cabinet_match:
-                                extracted_cabinet = cabinet_match.group(2)
-                                line = f"{i}. {extracted_cabinet} {clean_subject_name} 🔄"
-                            else:
-                                line = f"{i}. {clean_subject_name} 🔄"
-                    has_modifications = True
-                
-            elif i in static_pairs:
-                subject_name, cabinet, subject_id = static_pairs[i]
-                
-                if subject_name == "Свободно":
-                    line = f"{i}. Свободно"
-                else:
-                    import re
-                    clean_subject_name = re.sub(r'\s+(\d+\.?\d*[а-я]?|\d+\.?\d*/\d+\.?\d*|сп/з|актовый зал|спортзал)$', '', subject_name).strip()
-                    
-                    if cabinet and cabinet != "Не указан":
-                        line = f"{i}. {cabinet} {clean_subject_name}"
-                    else:
-                        cabinet_match = re.search(r'(\s+)(\d+\.?\d*[а-я]?|\d+\.?\d*/\d+\.?\d*|сп/з|актовый зал|спортзал)$', subject_name)
-                        if cabinet_match:
-                            extracted_cabinet = cabinet_match.group(2)
-                            line = f"{i}. {extracted_cabinet} {clean_subject_name}"
-                        else:
-                            line = f"{i}. {clean_subject_name}"
-            else:
-                line = f"{i}. Свободно"
+            await cur.execute("""
+                SELECT day, pair_number, subject_id, cabinet
+                FROM rasp_modifications
+                WHERE chat_id=%s AND week_type=%s
+                ORDER BY id
+            """, (chat_id, week_type))
+            modification_rows = await cur.fetchall()
             
-            msg_lines.append(line)
-        
-        result = "\n".join(msg_lines)
-        
-        if target_date is None:
-            target_date = datetime.datetime.now(TZ).date()
-        
-        target_date_str = target_date.strftime("%Y-%m-%d")
-        has_hw = await has_homework_for_date(pool, target_date_str)
-        
-        if has_hw:
-            result += "\n\n📚 Есть заданное домашнее задание"
+            await cur.execute("""
+                SELECT id, name, clean_name, default_cabinet
+                FROM subjects
+                WHERE id IN (
+                    SELECT subject_id FROM static_rasp WHERE week_type=%s
+                    UNION
+                    SELECT subject_id FROM rasp_modifications WHERE chat_id=%s AND week_type=%s
+                )
+            """, (week_type, chat_id, week_type))
+            subject_rows = await cur.fetchall()
+            
+            await cur.execute("""
+                SELECT DISTINCT due_date FROM homework
+                WHERE due_date BETWEEN %s AND %s
+            """, (date_from, date_to))
+            homework_dates = {row[0] for row in await cur.fetchall()}
+    
+    static_by_day = {}
+    for day, pair_number, subject_id, cabinet in static_rows:
+        static_by_day.setdefault(day, {})[pair_number] = (subject_id, cabinet)
+    
+    modifications_by_day = {}
+    for day, pair_number, subject_id, cabinet in modification_rows:
+        modifications_by_day.setdefault(day, {})[pair_number] = (subject_id, cabinet)
+    
+    subjects = {
+        subject_id: subject_entry(name, clean_name, default_cabinet)
+        for subject_id, name, clean_name, default_cabinet in subject_rows
+    }
+    
+    return static_by_day, modifications_by_day, subjects, homework_dates
+
+async def render_week(chat_id: int, week_type: int, week_start: datetime.date, pool=None):
+    """Тексты расписания на все шесть учебных дней недели.
+    
+    week_start - понедельник недели. Возвращает список (day, date, text).
+    """
+    if chat_id is None:
+        chat_id = ALLOWED_CHAT_IDS[0] if ALLOWED_CHAT_IDS else DEFAULT_CHAT_ID
+    
+    dates = {day: week_start + datetime.timedelta(days=day - 1) for day in range(1, 7)}
+    texts = {}
+    
+    for day, date in dates.items():
+        cached = rasp_model.render_cache.get((chat_id, day, week_type, date))
+        if cached is not None:
+            texts[day] = cached
+    
+    missing = [day for day in dates if day not in texts]
+    if missing:
+        if rasp_model.loaded:
+            subjects = rasp_model.subjects
+            homework_dates = rasp_model.homework_dates
+            static_by_day = {}
+            modifications_by_day = {}
+            for day in missing:
+                static_by_day[day], modifications_by_day[day] = rasp_model.get_day(chat_id, day, week_type)
+        else:
+            static_by_day, modifications_by_day, subjects, homework_dates = await resolve_rasp_week(
+                pool, chat_id, week_type, dates[1], dates[6]
+            )
         
-        if has_modifications:
-            result += "\n\n🔄 Отмечены измененные пары"
+        for day in missing:
+            text = format_rasp_day(
+                static_by_day.get(day, {}),
+                modifications_by_day.get(day, {}),
+                subjects,
+                dates[day] in homework_dates
+            )
+            rasp_model.render_cache.put((chat_id, day, week_type, dates[day]), text)
+            texts[day] = text
     
-    return result
+    return [(day, dates[day], texts[day]) for day in range(1, 7)]
 
-def check_flood(user_id: int) -> bool:
-    """Проверяет флуд, возвращает True если нужно блокировать"""
-    current_time = time.time()
-    if current_time - user_last_action[user_id] < FLOOD_DELAY:
-        return True
-    user_last_action[user_id] = current_time
-    return False
+async def get_week_formatted(chat_id: int, week_type: int, week_start: datetime.date, pool=None) -> str:
+    week_name = "нечетная" if week_type == 1 else "четная"
+    week_end = week_start + datetime.timedelta(days=5)
+    
+    blocks = [f"📅 Расписание на неделю {week_start.strftime('%d.%m')} - {week_end.strftime('%d.%m')} | Неделя: {week_name}"]
+    for day, date, text in await render_week(chat_id, week_type, week_start, pool=pool):
+        blocks.append(f"📌 {DAYS[day - 1]} ({date.strftime('%d.%m')})\n{text}")
+    
+    return "\n\n".join(blocks)
 
 def is_allowed_chat(chat_id: int) -> bool:
     return chat_id in ALLOWED_CHAT_IDS
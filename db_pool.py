@@ -0,0 +1,351 @@
+import asyncio
+import time
+import traceback
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+import aiomysql
+
+from config import *
+
+
+class PoolAcquireTimeout(Exception):
+    pass
+
+
+class _Acquire:
+    """async with pool.acquire() as conn - с замером ожидания и таймаутом"""
+
+    def __init__(self, pool: "MeteredPool"):
+        self.pool = pool
+        self.conn = None
+
+    async def __aenter__(self):
+        self.conn = await self.pool._acquire()
+        return self.conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.pool._release(self.conn)
+        self.conn = None
+
+
+class MeteredPool:
+    """Обёртка над aiomysql-пулом: таймаут acquire и метрики ожидания"""
+
+    def __init__(self, pool, acquire_timeout: float):
+        self._pool = pool
+        self.acquire_timeout = acquire_timeout
+        self.acquires = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.in_use = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.nested_acquires = 0
+        # Только при DB_POOL_DEBUG: задача -> сколько соединений она держит
+        self._held = {} if DB_POOL_DEBUG else None
+
+    def acquire(self):
+        return _Acquire(self)
+
+    async def _acquire(self):
+        if self._held is not None:
+            self._check_nested()
+
+        started = time.monotonic()
+        self.waiting += 1
+        # Отдельная задача, а не wait_for: если таймаут сработает в момент выдачи
+        # соединения, wait_for его потеряет, а задачу можно проверить и вернуть соединение
+        acquire_task = asyncio.ensure_future(self._pool.acquire())
+        try:
+            done, _ = await asyncio.wait({acquire_task}, timeout=self.acquire_timeout)
+        except BaseException:
+            self._abandon(acquire_task)
+            raise
+        finally:
+            self.waiting -= 1
+
+        if not done:
+            self._abandon(acquire_task)
+            self.timeouts += 1
+            print(f"⚠ Не дождались соединения из пула за {self.acquire_timeout} с. "
+                  f"(занято {self.in_use}/{self._pool.maxsize})")
+            raise PoolAcquireTimeout(f"Пул БД занят: нет свободного соединения за {self.acquire_timeout} с.")
+        conn = acquire_task.result()
+
+        wait = time.monotonic() - started
+        self.acquires += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        self.in_use += 1
+        if self._held is not None:
+            task = asyncio.current_task()
+            self._held[task] = self._held.get(task, 0) + 1
+        return conn
+
+    def _abandon(self, acquire_task):
+        """Отменяет acquire, который больше не ждут; выданное всё же соединение возвращает в пул"""
+        acquire_task.cancel()
+        acquire_task.add_done_callback(self._release_abandoned)
+
+    def _release_abandoned(self, acquire_task):
+        if not acquire_task.cancelled() and acquire_task.exception() is None:
+            self._pool.release(acquire_task.result())
+
+    def _release(self, conn):
+        self.in_use -= 1
+        if self._held is not None:
+            task = asyncio.current_task()
+            held = self._held.get(task, 0) - 1
+            if held > 0:
+                self._held[task] = held
+            else:
+                self._held.pop(task, None)
+        self._pool.release(conn)
+
+    def _check_nested(self):
+        """Задача уже держит соединение и просит ещё одно - под нагрузкой так пул встаёт"""
+        task = asyncio.current_task()
+        held = self._held.get(task, 0)
+        if not held:
+            return
+        self.nested_acquires += 1
+        stack = "".join(traceback.format_stack(limit=8)[:-2])
+        print(f"⚠ Вложенный acquire: задача {task.get_name() if task else '?'} уже держит "
+              f"{held} соединение(й) (занято {self.in_use}/{self._pool.maxsize})\n{stack}")
+
+    @property
+    def size(self) -> int:
+        return self._pool.size
+
+    @property
+    def freesize(self) -> int:
+        return self._pool.freesize
+
+    @property
+    def minsize(self) -> int:
+        return self._pool.minsize
+
+    @property
+    def maxsize(self) -> int:
+        return self._pool.maxsize
+
+    def stats(self) -> dict:
+        return {
+            'size': self.size,
+            'free': self.freesize,
+            'in_use': self.in_use,
+            'maxsize': self.maxsize,
+            'waiting': self.waiting,
+            'acquires': self.acquires,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': self.total_wait / self.acquires * 1000 if self.acquires else 0.0,
+            'max_wait_ms': self.max_wait * 1000,
+            'nested_acquires': self.nested_acquires
+        }
+
+    def close(self):
+        self._pool.close()
+
+    async def wait_closed(self):
+        await self._pool.wait_closed()
+
+
+async def create_pool() -> MeteredPool:
+    init_command = None
+    if DB_MAX_EXECUTION_TIME_MS:
+        # Таймаут чтения на стороне сервера: долгие SELECT прерываются MySQL
+        init_command = f"SET SESSION MAX_EXECUTION_TIME={DB_MAX_EXECUTION_TIME_MS}"
+
+    pool = await aiomysql.create_pool(
+        host=DB_HOST,
+        port=DB_PORT,
+        user=DB_USER,
+        password=DB_PASSWORD,
+        db=DB_NAME,
+        ssl=ssl_ctx,
+        autocommit=True,
+        minsize=DB_POOL_MINSIZE,
+        maxsize=DB_POOL_MAXSIZE,
+        pool_recycle=DB_POOL_RECYCLE,
+        connect_timeout=DB_CONNECT_TIMEOUT,
+        init_command=init_command
+    )
+    metered = MeteredPool(pool, DB_ACQUIRE_TIMEOUT)
+
+    if DB_POOL_WARMUP:
+        await warm_up(metered, min(DB_POOL_WARMUP, DB_POOL_MAXSIZE))
+
+    return metered
+
+
+async def warm_up(pool: MeteredPool, count: int):
+    """Открывает count соединений заранее, чтобы первые запросы не ждали подключения"""
+    async def ping():
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT 1")
+
+    await asyncio.gather(*(ping() for _ in range(count)))
+    print(f"✅ Пул БД прогрет: {pool.size} соединений (min {pool.minsize}, max {pool.maxsize})")
+
+
+# Открытый shared_connection/unit of work текущей задачи
+_uow_scope = ContextVar("uow_scope", default=None)
+
+
+class _Scope:
+    """Соединение блока, задача-владелец и отложенные до коммита действия"""
+
+    __slots__ = ("conn", "task", "hooks", "savepoints")
+
+    def __init__(self, conn, hooks=None):
+        self.conn = conn
+        self.task = asyncio.current_task()
+        # None - транзакции нет (shared_connection)
+        self.hooks = hooks
+        self.savepoints = 0
+
+
+def _current_scope():
+    """Scope текущей задачи.
+
+    Задачи, созданные внутри блока (create_task, gather), наследуют ContextVar, но
+    соединение им не принадлежит: владелец вернёт его в пул, не дожидаясь их.
+    Такие задачи работают как вне блока - со своими соединениями из пула.
+    """
+    scope = _uow_scope.get()
+    if scope is not None and scope.task is asyncio.current_task():
+        return scope
+    return None
+
+
+def in_unit_of_work() -> bool:
+    """Открыта ли транзакция unit of work (shared_connection сам по себе не считается)"""
+    scope = _current_scope()
+    return scope is not None and scope.hooks is not None
+
+
+@asynccontextmanager
+async def db_connection(pool):
+    """Соединение текущего unit of work или shared_connection, а вне них - отдельное соединение из пула"""
+    scope = _current_scope()
+    if scope is not None:
+        yield scope.conn
+        return
+
+    async with pool.acquire() as conn:
+        yield conn
+
+
+@asynccontextmanager
+async def shared_connection(pool):
+    """Одно соединение на несколько чтений, без транзакции (без BEGIN/COMMIT).
+    
+    Функции database.py внутри блока берут его через db_connection;
+    unit_of_work внутри блока открывает транзакцию на этом же соединении.
+    Задачи, запущенные из блока, соединение не получают (см. _current_scope).
+    """
+    scope = _current_scope()
+    if scope is not None:
+        yield scope.conn
+        return
+    
+    async with pool.acquire() as conn:
+        token = _uow_scope.set(_Scope(conn))
+        try:
+            yield conn
+        finally:
+            _uow_scope.reset(token)
+
+
+async def _execute(conn, sql: str):
+    async with conn.cursor() as cur:
+        await cur.execute(sql)
+
+
+@asynccontextmanager
+async def _transaction(conn):
+    await conn.begin()
+    scope = _Scope(conn, hooks=[])
+    token = _uow_scope.set(scope)
+    try:
+        yield conn
+        await conn.commit()
+    except BaseException:
+        await conn.rollback()
+        raise
+    finally:
+        _uow_scope.reset(token)
+    
+    for hook in scope.hooks:
+        hook()
+
+
+@asynccontextmanager
+async def _savepoint(scope: _Scope):
+    """Вложенный блок внутри транзакции: при исключении откатывается только он.
+
+    Иначе перехваченная внутри ошибка оставила бы половину записи, и внешний
+    unit of work её закоммитил бы. Хуки блока переходят во внешний только при успехе.
+    """
+    scope.savepoints += 1
+    name = f"uow_sp{scope.savepoints}"
+    outer_hooks = scope.hooks
+    scope.hooks = []
+    await _execute(scope.conn, f"SAVEPOINT {name}")
+    try:
+        yield scope.conn
+        await _execute(scope.conn, f"RELEASE SAVEPOINT {name}")
+        outer_hooks.extend(scope.hooks)
+    except BaseException:
+        await _execute(scope.conn, f"ROLLBACK TO SAVEPOINT {name}")
+        raise
+    finally:
+        scope.hooks = outer_hooks
+        scope.savepoints -= 1
+
+
+@asynccontextmanager
+async def unit_of_work(pool):
+    """Одно соединение и одна транзакция на весь блок.
+    
+    Все функции database.py внутри блока берут это соединение через
+    db_connection/db_transaction; коммит один - при выходе из блока,
+    при исключении всё откатывается. Вложенный unit_of_work становится
+    SAVEPOINT внешнего: его ошибка откатывает только его часть.
+    Только для записи: для нескольких чтений хватает shared_connection.
+    """
+    scope = _current_scope()
+    if scope is not None and scope.hooks is not None:
+        async with _savepoint(scope) as conn:
+            yield conn
+        return
+    
+    if scope is not None:
+        async with _transaction(scope.conn):
+            yield scope.conn
+        return
+    
+    async with pool.acquire() as conn:
+        async with _transaction(conn):
+            yield conn
+
+
+@asynccontextmanager
+async def db_transaction(pool):
+    """Транзакция для многошаговой записи: своя или часть текущего unit of work"""
+    async with unit_of_work(pool) as conn:
+        yield conn
+
+
+def after_commit(hook):
+    """Выполнить hook после коммита текущего unit of work (или сразу, если его нет).
+
+    Так модель расписания в памяти меняется только вместе с БД.
+    """
+    scope = _current_scope()
+    if scope is None or scope.hooks is None:
+        hook()
+    else:
+        scope.hooks.append(hook)
@@ -1,11 +1,9 @@
-from aiogram import Bot, Dispatcher, types, F
+from aiogram import types, F
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ChatPermissions
-from aiogram.fsm.storage.memory import MemoryStorage
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from aiogram.types import InputMediaPhoto, InputMediaVideo, InputMediaDocument, InputMediaAudio
 from apscheduler.triggers.cron import CronTrigger
-from aiogram.exceptions import TelegramRetryAfter
 from bot_init import dp, bot, pool  # Импортируем dp и bot
 
 import asyncio
@@ -15,35 +13,20 @@ import re
 import aiohttp
 import io
 from bs4 import BeautifulSoup
-import time
 
 from config import *
 from database import *
 from states import *
 from keyboards import *
-
-# Инициализация бота и диспетчера
-bot = Bot(token=TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
-scheduler = AsyncIOScheduler(timezone=TZ)
-
-# Глобальная переменная для пула БД (будет инициализирована в main)
-pool = None
+from middlewares import UserContext
+from sender import broadcast, delivered
 
 # ========== ОБЩИЕ ФУНКЦИИ ==========
 
 async def safe_edit_message(callback: types.CallbackQuery, text: str, markup=None):
-    """Безопасное редактирование сообщения с обработкой RetryAfter"""
+    """Безопасное редактирование сообщения (RetryAfter обрабатывает sender.SendRateMiddleware)"""
     try:
         await callback.message.edit_text(text, reply_markup=markup)
-    except TelegramRetryAfter as e:
-        wait_time = e.retry_after
-        print(f"⏳ Telegram просит подождать {wait_time} секунд")
-        await asyncio.sleep(wait_time)
-        try:
-            await callback.message.edit_text(text, reply_markup=markup)
-        except Exception as retry_error:
-            print(f"Ошибка при повторной попытке: {retry_error}")
     except Exception as e:
         print(f"Ошибка редактирования: {e}")
         try:
@@ -51,10 +34,9 @@ async def safe_edit_message(callback: types.CallbackQuery, text: str, markup=Non
         except Exception as answer_error:
             print(f"Ошибка отправки нового сообщения: {answer_error}")
 
-async def safe_send_message(chat_id: int, text: str, reply_markup=None, delay: float = 0.1):
-    """Безопасная отправка сообщения с задержкой"""
+async def safe_send_message(chat_id: int, text: str, reply_markup=None):
+    """Безопасная отправка сообщения"""
     try:
-        await asyncio.sleep(delay)
         await bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
         return True
     except Exception as e:
@@ -63,17 +45,18 @@ async def safe_send_message(chat_id: int, text: str, reply_markup=None, delay: f
 async def greet_and_send(user: types.User, text: str, message: types.Message = None, 
                         callback: types.CallbackQuery = None, markup=None, 
                         chat_id: int | None = None, include_joke: bool = False, 
-                        include_week_info: bool = False):
-    await asyncio.sleep(0.1)
-    
+                        include_week_info: bool = False, user_ctx: UserContext | None = None):
     try:
         if include_joke:
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute("SELECT text FROM anekdoty ORDER BY RAND() LIMIT 1")
-                    row = await cur.fetchone()
-                    if row:
-                        text += f"\n\n😂 Анекдот:\n{row[0]}"
+            if callback:
+                joke_chat_id = callback.message.chat.id
+            elif message:
+                joke_chat_id = message.chat.id
+            else:
+                joke_chat_id = chat_id if chat_id is not None else user.id
+            joke = await get_anekdot(pool, joke_chat_id)
+            if joke:
+                text += f"\n\n😂 Анекдот:\n{joke}"
         
         week_info = ""
         if include_week_info:
@@ -84,7 +67,10 @@ async def greet_and_send(user: types.User, text: str, message: types.Message = N
             except Exception as e:
                 week_info = f"\n\n📅 Информация о неделе временно недоступна"
         
-        nickname = await get_nickname(pool, user.id)
+        if user_ctx is not None:
+            nickname = user_ctx.nickname
+        else:
+            nickname = await get_nickname(pool, user.id)
         greet = f"👋 Салам, {nickname}!\n\n" if nickname else "👋 Салам!\n\n"
         full_text = greet + text + week_info
         
@@ -96,7 +82,6 @@ async def greet_and_send(user: types.User, text: str, message: types.Message = N
                 await callback.message.edit_text(full_text, reply_markup=markup)
             except Exception as edit_error:
                 try:
-                    await asyncio.sleep(0.1)
                     await callback.message.answer(full_text, reply_markup=markup)
                 except Exception as answer_error:
                     print(f"Ошибка отправки сообщения: {answer_error}")
@@ -122,7 +107,7 @@ async def greet_and_send(user: types.User, text: str, message: types.Message = N
 # ========== ОБРАБОТЧИКИ КОМАНД ==========
 
 @dp.message(Command("аркадий", "акрадый", "акрадий", "аркаша", "котов", "arkadiy", "arkadiy@arcadiyis07_bot"))
-async def trigger_handler(message: types.Message):
+async def trigger_handler(message: types.Message, user_ctx: UserContext):
     is_private = message.chat.type == "private"
     is_allowed_chat = message.chat.id in ALLOWED_CHAT_IDS
     
@@ -130,25 +115,17 @@ async def trigger_handler(message: types.Message):
         await message.answer("⛔ Бот не работает в этом чате")
         return
     
-    is_admin = (message.from_user.id in ALLOWED_USERS) and is_private
-    
-    is_special_user = False
-    if is_private:
-        signature = await get_special_user_signature(pool, message.from_user.id)
-        is_special_user = signature is not None
-
-    is_fund_manager = (message.from_user.id == FUND_MANAGER_USER_ID) and is_private
-
     await greet_and_send(
         message.from_user, 
         "Выберите действие:", 
         message=message, 
         markup=await main_menu(
-            is_admin=is_admin, 
-            is_special_user=is_special_user, 
+            is_admin=user_ctx.is_admin and is_private, 
+            is_special_user=user_ctx.is_special_user and is_private, 
             is_group_chat=not is_private,
-            is_fund_manager=is_fund_manager
-        )
+            is_fund_manager=user_ctx.is_fund_manager and is_private
+        ),
+        user_ctx=user_ctx
     )
 
 @dp.message(Command("никнейм"))
@@ -175,14 +152,11 @@ async def cmd_anekdot(message: types.Message):
     if not is_allowed_chat(message.chat.id):
         return
     
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT text FROM anekdoty ORDER BY RAND() LIMIT 1")
-            row = await cur.fetchone()
-            if row:
-                await message.answer(f"😂 Анекдот:\n\n{row[0]}")
-            else:
-                await message.answer("❌ В базе пока нет анекдотов.")
+    joke = await get_anekdot(pool, message.chat.id)
+    if joke:
+        await message.answer(f"😂 Анекдот:\n\n{joke}")
+    else:
+        await message.answer("❌ В базе пока нет анекдотов.")
 
 @dp.message(Command("акик", "акick"))
 async def cmd_admin_kick(message: types.Message):
@@ -504,8 +478,9 @@ async def cmd_export_database(message: types.Message):
         tables = [
             'rasp', 'birthdays', 'nicknames', 'static_rasp', 'rasp_modifications',
             'publish_times', 'anekdoty', 'subjects', 'special_users', 'rasp_detailed',
-            'current_week_type', 'teacher_messages', 'group_fund_balance',
-            'group_fund_members', 'group_fund_purchases', 'homework'
+            'current_week_type', 'teacher_messages', 'teacher_message_deliveries',
+            'group_fund_balance', 'group_fund_members', 'group_fund_purchases', 'homework',
+            'schema_version'
         ]
         
         sql_content = f"-- Backup created at {datetime.datetime.now(TZ).strftime('%Y-%m-%d %H:%M:%S')}\n"
@@ -526,13 +501,14 @@ async def cmd_export_database(message: types.Message):
                     if create_table:
                         sql_content += f"{create_table[1]};\n\n"
                     
-                    await cur.execute(f"SELECT * FROM {table}")
+                    # Генерируемые столбцы (birthdays.birth_md) MySQL не даёт вставлять явно
+                    await cur.execute(f"DESCRIBE {table}")
+                    columns = [col[0] for col in await cur.fetchall() if 'GENERATED' not in (col[5] or '').upper()]
+                    
+                    await cur.execute(f"SELECT {', '.join(columns)} FROM {table}")
                     rows = await cur.fetchall()
                     
                     if rows:
-                        await cur.execute(f"DESCRIBE {table}")
-                        columns = [col[0] for col in await cur.fetchall()]
-                        
                         sql_content += f"-- Data for table {table} ({len(rows)} rows)\n"
                         
                         for row in rows:
@@ -665,6 +641,14 @@ async def execute_sql_query(message: types.Message, sql_query: str):
                 
                 if query_type not in ('SELECT', 'SHOW', 'DESCRIBE'):
                     await conn.commit()
+        
+        # Сырой SQL мог изменить расписание - перечитываем модель
+        if query_type not in ('SELECT', 'SHOW', 'DESCRIBE'):
+            await load_rasp_model(pool)
+            if 'anekdoty' in sql_query.lower():
+                await load_anekdoty(pool)
+            if 'nicknames' in sql_query.lower() or 'special_users' in sql_query.lower():
+                user_profiles.clear()
                 
     except Exception as e:
         error_msg = f"❌ Ошибка выполнения SQL запроса:\n\n`{e}`"
@@ -708,17 +692,70 @@ async def cmd_delptime(message: types.Message):
         await message.answer(f"✅ Время публикации с id={pid} удалено и задачи пересозданы.")
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}")
-# ========== ОБРАБОТЧИКИ КНОПОК ==========
 
-@dp.callback_query(F.data == "menu_back")
-async def menu_back_handler(callback: types.CallbackQuery, state: FSMContext):
-    if check_flood(callback.from_user.id):
-        try:
-            await callback.answer("⏳ Подождите немного...", show_alert=False)
-        except:
-            pass
+@dp.message(Command("pool", "пул"))
+async def cmd_pool_stats(message: types.Message):
+    if message.from_user.id not in ALLOWED_USERS:
+        await message.answer("⛔ У вас нет прав")
+        return
+    
+    stats = pool.stats()
+    cache = rasp_model.render_cache.stats()
+    
+    await message.answer(
+        f"🗄 Пул БД\n"
+        f"Соединений: {stats['size']} (свободно {stats['free']}, занято {stats['in_use']}, макс. {stats['maxsize']})\n"
+        f"Ждут соединения: {stats['waiting']}\n"
+        f"Выдач: {stats['acquires']}, таймаутов: {stats['timeouts']}, вложенных: {stats['nested_acquires']}\n"
+        f"Ожидание: среднее {stats['avg_wait_ms']:.1f} мс, макс. {stats['max_wait_ms']:.1f} мс\n\n"
+        f"📅 Кэш расписания\n"
+        f"Записей: {cache['size']}, попаданий: {cache['hits']}, промахов: {cache['misses']} "
+        f"({cache['hit_rate']:.0%})"
+    )
+
+@dp.message(Command("explain"))
+async def cmd_explain(message: types.Message):
+    if message.from_user.id not in ALLOWED_USERS:
+        await message.answer("⛔ У вас нет прав")
+        return
+    
+    try:
+        problems = await explain_hot_queries(pool)
+    except Exception as e:
+        await message.answer(f"❌ Ошибка EXPLAIN: {e}")
+        return
+    
+    if not problems:
+        await message.answer(f"✅ Все {len(HOT_QUERIES)} горячих запросов используют индексы")
         return
     
+    lines = [f"• {name}: {table} (type={access_type}, key={key})" for name, table, access_type, key in problems]
+    await message.answer("⚠ Запросы без индекса:\n" + "\n".join(lines))
+
+@dp.message(Command("неделя"))
+async def cmd_week(message: types.Message):
+    is_private = message.chat.type == "private"
+    is_allowed_chat = message.chat.id in ALLOWED_CHAT_IDS
+    
+    if not (is_private or is_allowed_chat):
+        return
+    
+    today = datetime.datetime.now(TZ).date()
+    week_start = today - datetime.timedelta(days=today.isoweekday() - 1)
+    week_type = await get_current_week_type(pool)
+    
+    # В воскресенье или по "/неделя след" показываем наступающую неделю
+    parts = message.text.split(maxsplit=1)
+    if today.isoweekday() == 7 or (len(parts) > 1 and parts[1].lower().startswith("след")):
+        week_start += datetime.timedelta(days=7)
+        week_type = 2 if week_type == 1 else 1
+    
+    text = await get_week_formatted(message.chat.id, week_type, week_start, pool=pool)
+    await message.answer(text)
+# ========== ОБРАБОТЧИКИ КНОПОК ==========
+
+@dp.callback_query(F.data == "menu_back", flags={"throttling": "rasp"})
+async def menu_back_handler(callback: types.CallbackQuery, state: FSMContext, user_ctx: UserContext | None = None):
     is_private = callback.message.chat.type == "private"
     is_allowed_chat = callback.message.chat.id in ALLOWED_CHAT_IDS
     
@@ -734,30 +771,25 @@ async def menu_back_handler(callback: types.CallbackQuery, state: FSMContext):
     except Exception:
         pass
     
-    is_admin = (callback.from_user.id in ALLOWED_USERS) and is_private
-    
-    is_special_user = False
-    if is_private:
-        signature = await get_special_user_signature(pool, callback.from_user.id)
-        is_special_user = signature is not None
-
-    is_fund_manager = (callback.from_user.id == FUND_MANAGER_USER_ID) and is_private
-
     try:
         await callback.message.delete()
     except Exception:
         pass
     
+    if user_ctx is None:
+        # Прямой вызов не из диспетчера - контекст не внедрён middleware
+        nickname, signature = await get_user_profile(pool, callback.from_user.id)
+        user_ctx = UserContext(callback.from_user.id, nickname, signature)
+    
     await safe_send_message(
         callback.message.chat.id,
         "Выберите действие:",
         reply_markup=await main_menu(
-            is_admin=is_admin, 
-            is_special_user=is_special_user, 
+            is_admin=user_ctx.is_admin and is_private, 
+            is_special_user=user_ctx.is_special_user and is_private, 
             is_group_chat=not is_private,
-            is_fund_manager=is_fund_manager
-        ),
-        delay=0.2
+            is_fund_manager=user_ctx.is_fund_manager and is_private
+        )
     )
     
     try:
@@ -766,7 +798,7 @@ async def menu_back_handler(callback: types.CallbackQuery, state: FSMContext):
         pass
 
 @dp.callback_query(F.data.startswith("menu_"))
-async def menu_handler(callback: types.CallbackQuery, state: FSMContext):
+async def menu_handler(callback: types.CallbackQuery, state: FSMContext, user_ctx: UserContext):
     is_private = callback.message.chat.type == "private"
     is_allowed_chat = callback.message.chat.id in ALLOWED_CHAT_IDS
     
@@ -794,7 +826,7 @@ async def menu_handler(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer()
     
     elif action == "menu_back":
-        await menu_back_handler(callback, state)
+        await menu_back_handler(callback, state, user_ctx)
     
     elif action == "menu_homework":
         await menu_homework_handler(callback)
@@ -805,15 +837,8 @@ async def menu_handler(callback: types.CallbackQuery, state: FSMContext):
     elif action == "menu_group_fund":
         await menu_group_fund_handler(callback)
 
-@dp.callback_query(F.data.startswith("rasp_day_"))
+@dp.callback_query(F.data.startswith("rasp_day_"), flags={"throttling": "rasp"})
 async def on_rasp_day(callback: types.CallbackQuery):
-    if check_flood(callback.from_user.id):
-        try:
-            await callback.answer("⏳ Подождите немного...", show_alert=False)
-        except:
-            pass
-        return
-
     is_private = callback.message.chat.type == "private"
     is_allowed_chat = callback.message.chat.id in ALLOWED_CHAT_IDS
     
@@ -842,7 +867,7 @@ async def on_rasp_day(callback: types.CallbackQuery):
     except:
         pass
 
-@dp.callback_query(F.data.startswith("rasp_show_"))
+@dp.callback_query(F.data.startswith("rasp_show_"), flags={"throttling": "rasp"})
 async def on_rasp_show(callback: types.CallbackQuery):
     is_private = callback.message.chat.type == "private"
     is_allowed_chat = callback.message.chat.id in ALLOWED_CHAT_IDS
@@ -862,8 +887,6 @@ async def on_rasp_show(callback: types.CallbackQuery):
     target_date = today + datetime.timedelta(days=days_ahead)
     
     chat_id = callback.message.chat.id
-    text = await get_rasp_formatted(day, week_type, chat_id, target_date)
-    
     kb = back_to_menu_keyboard()
     
     day_names = {
@@ -877,16 +900,20 @@ async def on_rasp_show(callback: types.CallbackQuery):
     
     week_name = "нечетная" if week_type == 1 else "четная"
     
+    # Только чтение: общее соединение без BEGIN/COMMIT
+    async with shared_connection(pool):
+        text = await get_rasp_formatted(day, week_type, chat_id, target_date, pool=pool)
+        birthday_footer = await format_birthday_footer(pool)
+    
     message = f"📅 {day_names[day]} | Неделя: {week_name}\n\n{text}"
     
-    birthday_footer = await format_birthday_footer(pool)
     if birthday_footer:
         message += birthday_footer
     
     await callback.message.edit_text(message, reply_markup=kb)
     await callback.answer()
 
-@dp.callback_query(F.data == "today_rasp")
+@dp.callback_query(F.data == "today_rasp", flags={"throttling": "rasp"})
 async def today_rasp_handler(callback: types.CallbackQuery):
     is_private = callback.message.chat.type == "private"
     is_allowed_chat = callback.message.chat.id in ALLOWED_CHAT_IDS
@@ -919,25 +946,24 @@ async def today_rasp_handler(callback: types.CallbackQuery):
         }
         display_text = f"{day_name} ({day_names[current_weekday]})"
     
-    week_type = await get_current_week_type(pool)
-    
-    if day_to_show == 1 and current_weekday == 7:
-        week_type = 2 if week_type == 1 else 1
-    
-    text = await get_rasp_formatted(day_to_show, week_type, chat_id, target_date)
+    # Четность, анекдот и дни рождения - несколько чтений через одно соединение
+    async with shared_connection(pool):
+        week_type = await get_current_week_type(pool)
+        
+        if day_to_show == 1 and current_weekday == 7:
+            week_type = 2 if week_type == 1 else 1
+        
+        text = await get_rasp_formatted(day_to_show, week_type, chat_id, target_date, pool=pool)
+        joke = await get_anekdot(pool, chat_id)
+        birthday_footer = await format_birthday_footer(pool)
     
     week_name = "нечетная" if week_type == 1 else "четная"
     
     message = f"📅 Расписание на {display_text} | Неделя: {week_name}\n\n{text}"
     
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT text FROM anekdoty ORDER BY RAND() LIMIT 1")
-            row = await cur.fetchone()
-            if row:
-                message += f"\n\n😂 Анекдот:\n{row[0]}"
+    if joke:
+        message += f"\n\n😂 Анекдот:\n{joke}"
     
-    birthday_footer = await format_birthday_footer(pool)
     if birthday_footer:
         message += birthday_footer
     
@@ -946,7 +972,7 @@ async def today_rasp_handler(callback: types.CallbackQuery):
     await callback.message.edit_text(message, reply_markup=kb)
     await callback.answer()
 
-@dp.callback_query(F.data == "tomorrow_rasp")
+@dp.callback_query(F.data == "tomorrow_rasp", flags={"throttling": "rasp"})
 async def tomorrow_rasp_handler(callback: types.CallbackQuery):
     is_private = callback.message.chat.type == "private"
     is_allowed_chat = callback.message.chat.id in ALLOWED_CHAT_IDS
@@ -978,25 +1004,24 @@ async def tomorrow_rasp_handler(callback: types.CallbackQuery):
         }
         display_text = f"завтра ({day_names[day_to_show]})"
     
-    week_type = await get_current_week_type(pool)
-    
-    if day_to_show == 1 and (current_weekday == 7 or current_weekday == 6):
-        week_type = 2 if week_type == 1 else 1
-    
-    text = await get_rasp_formatted(day_to_show, week_type, chat_id, target_date)
+    # Четность, анекдот и дни рождения - несколько чтений через одно соединение
+    async with shared_connection(pool):
+        week_type = await get_current_week_type(pool)
+        
+        if day_to_show == 1 and (current_weekday == 7 or current_weekday == 6):
+            week_type = 2 if week_type == 1 else 1
+        
+        text = await get_rasp_formatted(day_to_show, week_type, chat_id, target_date, pool=pool)
+        joke = await get_anekdot(pool, chat_id)
+        birthday_footer = await format_birthday_footer(pool)
     
     week_name = "нечетная" if week_type == 1 else "четная"
     
     message = f"📅 Расписание на {display_text} | Неделя: {week_name}\n\n{text}"
     
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            await cur.execute("SELECT text FROM anekdoty ORDER BY RAND() LIMIT 1")
-            row = await cur.fetchone()
-            if row:
-                message += f"\n\n😂 Анекдот:\n{row[0]}"
+    if joke:
+        message += f"\n\n😂 Анекдот:\n{joke}"
     
-    birthday_footer = await format_birthday_footer(pool)
     if birthday_footer:
         message += birthday_footer
     
@@ -1225,7 +1250,7 @@ async def show_teacher_messages_page(callback: types.CallbackQuery, state: FSMCo
         if not display_text:
             display_text = f"{msg_type} сообщение"
         
-        emoji = "📝" if msg_type == "text" else "🖼️" if msg_type == "photo" else "📎" if msg_type == "document" else "🎵"
+        emoji = "📝" if msg_type == "text" else "🖼️" if msg_type in ("photo", "album") else "📎" if msg_type == "document" else "🎵"
         button_text = f"{emoji} {signature}: {display_text}"
         
         keyboard.append([InlineKeyboardButton(
@@ -1266,11 +1291,17 @@ async def view_specific_message(callback: types.CallbackQuery):
         
         async with pool.acquire() as conn:
             async with conn.cursor() as cur:
+                # Ссылка ведёт на копию сообщения в текущем чате, а не в первом из рассылки
                 await cur.execute("""
-                    SELECT message_id, signature, message_text, message_type, created_at
-                    FROM teacher_messages 
-                    WHERE id = %s
-                """, (message_db_id,))
+                    SELECT COALESCE(
+                               (SELECT MIN(d.message_id) FROM teacher_message_deliveries d
+                                WHERE d.teacher_message_id = tm.id AND d.chat_id = %s),
+                               tm.message_id
+                           ),
+                           tm.signature, tm.message_text, tm.message_type, tm.created_at
+                    FROM teacher_messages tm
+                    WHERE tm.id = %s
+                """, (current_chat_id, message_db_id))
                 
                 message_data = await cur.fetchone()
         
@@ -1330,7 +1361,7 @@ async def messages_page_handler(callback: types.CallbackQuery, state: FSMContext
 # ========== СПЕЦ-ПОЛЬЗОВАТЕЛИ ==========
 
 @dp.callback_query(F.data == "send_message_chat")
-async def send_message_chat_start(callback: types.CallbackQuery, state: FSMContext):
+async def send_message_chat_start(callback: types.CallbackQuery, state: FSMContext, user_ctx: UserContext):
     is_private = callback.message.chat.type == "private"
     is_allowed_chat = callback.message.chat.id in ALLOWED_CHAT_IDS
     
@@ -1342,7 +1373,7 @@ async def send_message_chat_start(callback: types.CallbackQuery, state: FSMConte
         await callback.answer("⛔ Доступно только конкретному пользователю", show_alert=True)
         return
 
-    signature = await get_special_user_signature(pool, callback.from_user.id)
+    signature = user_ctx.signature
     if not signature:
         signature = "ПРОВЕРКА"
 
@@ -1389,6 +1420,75 @@ async def stop_forward_mode_handler(callback: types.CallbackQuery, state: FSMCon
         await callback.answer("❌ Режим пересылки не активен", show_alert=True)
     await callback.answer()
 
+# Типы медиа для пересылки -> как называть их в сообщении об ошибке подписи
+FORWARD_MEDIA_TYPES = {
+    "photo": "фото",
+    "document": "документам",
+    "video": "видео",
+    "audio": "аудио",
+    "voice": "голосовым",
+    "sticker": "стикерам"
+}
+
+# Части альбомов, ожидающие пересылки: media_group_id -> {"messages": [...], "signature": ...}
+pending_albums = {}
+
+ALBUM_MEDIA_TYPES = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio
+}
+
+def build_album_media(messages: list, prefix: str):
+    """InputMedia для send_media_group; подпись с префиксом ставится на первую часть"""
+    caption = next((m.caption for m in messages if m.caption), "")
+    media = []
+    for i, part in enumerate(messages):
+        for media_type, input_media in ALBUM_MEDIA_TYPES.items():
+            content = getattr(part, media_type)
+            if content:
+                file_id = content[-1].file_id if media_type == "photo" else content.file_id
+                media.append(input_media(media=file_id, caption=prefix + caption if i == 0 else None))
+                break
+    return media, caption
+
+async def flush_album(media_group_id: str):
+    await asyncio.sleep(ALBUM_COLLECT_SECONDS)
+    album = pending_albums.pop(media_group_id, None)
+    if not album:
+        return
+    
+    messages = sorted(album["messages"], key=lambda m: m.message_id)
+    first = messages[0]
+    signature = album["signature"]
+    
+    try:
+        if any(m.caption and m.caption.startswith('/') for m in messages):
+            await first.answer("❌ Подписи к альбомам, начинающиеся с /, не отправляются.")
+            return
+        
+        media, caption = build_album_media(messages, f"Сообщение от {signature}: ")
+        results = await broadcast(ALLOWED_CHAT_IDS, lambda chat_id: bot.send_media_group(chat_id, media))
+        sent_message_ids = list(delivered(results).values())
+        
+        if sent_message_ids:
+            await save_teacher_message(
+                pool,
+                sent_message_ids[0][0],
+                first.from_user.id,
+                signature,
+                caption,
+                "album",
+                deliveries=delivered(results)
+            )
+        
+        await first.answer(
+            f"✅ Альбом ({len(media)} шт.) переслан в {len(sent_message_ids)} из {len(ALLOWED_CHAT_IDS)} бесед!"
+        )
+    except Exception as e:
+        await first.answer(f"❌ Ошибка при пересылке альбома: {e}")
+
 @dp.message(SendMessageState.active)
 async def process_forward_message(message: types.Message, state: FSMContext):
     if message.text and message.text.startswith('/'):
@@ -1398,97 +1498,50 @@ async def process_forward_message(message: types.Message, state: FSMContext):
     data = await state.get_data()
     signature = data.get("signature", "ПРОВЕРКА")
     
+    # Части альбома приходят отдельными апдейтами - собираем их и шлём одним send_media_group
+    if message.media_group_id:
+        album = pending_albums.get(message.media_group_id)
+        if album is None:
+            album = pending_albums[message.media_group_id] = {"messages": [message], "signature": signature}
+            # Ссылка на задачу в буфере, чтобы её не собрал сборщик мусора во время ожидания
+            album["task"] = asyncio.create_task(flush_album(message.media_group_id))
+        else:
+            album["messages"].append(message)
+        return
+    
     prefix = f"Сообщение от {signature}: "
 
     try:
-        message_text = ""
-        message_type = "text"
-        sent_message_ids = []
-        
         if message.text:
             message_text = message.text
-            for chat_id in ALLOWED_CHAT_IDS:
-                try:
-                    sent_message = await bot.send_message(chat_id, f"{prefix}{message.text}")
-                    sent_message_ids.append(sent_message.message_id)
-                except Exception as e:
-                    print(f"Ошибка отправки в чат {chat_id}: {e}")
-                    
-        elif message.photo:
-            message_text = message.caption or ""
-            message_type = "photo"
-            if message.caption and message.caption.startswith('/'):
-                await message.answer("❌ Подписи к фото, начинающиеся с /, не отправляются.")
-                return
-            for chat_id in ALLOWED_CHAT_IDS:
-                try:
-                    sent_message = await bot.send_photo(chat_id, message.photo[-1].file_id, caption=prefix + (message.caption or ""))
-                    sent_message_ids.append(sent_message.message_id)
-                except Exception as e:
-                    print(f"Ошибка отправки фото в чат {chat_id}: {e}")
-                    
-        elif message.document:
-            message_text = message.caption or ""
-            message_type = "document"
-            if message.caption and message.caption.startswith('/'):
-                await message.answer("❌ Подписи к документам, начинающиеся с /, не отправляются.")
-                return
-            for chat_id in ALLOWED_CHAT_IDS:
-                try:
-                    sent_message = await bot.send_document(chat_id, message.document.file_id, caption=prefix + (message.caption or ""))
-                    sent_message_ids.append(sent_message.message_id)
-                except Exception as e:
-                    print(f"Ошибка отправки документа в чат {chat_id}: {e}")
-                    
-        elif message.video:
-            message_text = message.caption or ""
-            message_type = "video"
-            if message.caption and message.caption.startswith('/'):
-                await message.answer("❌ Подписи к видео, начинающиеся с /, не отправляются.")
-                return
-            for chat_id in ALLOWED_CHAT_IDS:
-                try:
-                    sent_message = await bot.send_video(chat_id, message.video.file_id, caption=prefix + (message.caption or ""))
-                    sent_message_ids.append(sent_message.message_id)
-                except Exception as e:
-                    print(f"Ошибка отправки видео в чат {chat_id}: {e}")
-                    
-        elif message.audio:
-            message_text = message.caption or ""
-            message_type = "audio"
-            if message.caption and message.caption.startswith('/'):
-                await message.answer("❌ Подписи к аудио, начинающиеся с /, не отправляются.")
-                return
-            for chat_id in ALLOWED_CHAT_IDS:
-                try:
-                    sent_message = await bot.send_audio(chat_id, message.audio.file_id, caption=prefix + (message.caption or ""))
-                    sent_message_ids.append(sent_message.message_id)
-                except Exception as e:
-                    print(f"Ошибка отправки аудио в чат {chat_id}: {e}")
-                    
-        elif message.voice:
-            message_text = "голосовое сообщение"
-            message_type = "voice"
-            for chat_id in ALLOWED_CHAT_IDS:
-                try:
-                    sent_message = await bot.send_voice(chat_id, message.voice.file_id, caption=prefix)
-                    sent_message_ids.append(sent_message.message_id)
-                except Exception as e:
-                    print(f"Ошибка отправки голосового сообщения в чат {chat_id}: {e}")
-                    
-        elif message.sticker:
-            message_text = "стикер"
-            message_type = "sticker"
-            for chat_id in ALLOWED_CHAT_IDS:
-                try:
-                    sent_message = await bot.send_sticker(chat_id, message.sticker.file_id)
-                    sent_message_ids.append(sent_message.message_id)
-                except Exception as e:
-                    print(f"Ошибка отправки стикера в чат {chat_id}: {e}")
-                    
+            message_type = "text"
+            send = lambda chat_id: bot.send_message(chat_id, f"{prefix}{message.text}")
         else:
-            await message.answer("⚠ Не удалось распознать тип сообщения.")
-            return
+            for message_type in FORWARD_MEDIA_TYPES:
+                if getattr(message, message_type):
+                    break
+            else:
+                await message.answer("⚠ Не удалось распознать тип сообщения.")
+                return
+            
+            if message_type == "voice":
+                message_text = "голосовое сообщение"
+                caption = prefix
+            elif message_type == "sticker":
+                message_text = "стикер"
+                caption = None
+            else:
+                message_text = message.caption or ""
+                caption = prefix + message_text
+                if message_text.startswith('/'):
+                    await message.answer(f"❌ Подписи к {FORWARD_MEDIA_TYPES[message_type]}, начинающиеся с /, не отправляются.")
+                    return
+            
+            # copy_message не перезаливает файл и работает для любого типа медиа
+            send = lambda chat_id: bot.copy_message(chat_id, message.chat.id, message.message_id, caption=caption)
+        
+        results = await broadcast(ALLOWED_CHAT_IDS, send)
+        sent_message_ids = list(delivered(results).values())
 
         if sent_message_ids:
             await save_teacher_message(
@@ -1497,7 +1550,8 @@ async def process_forward_message(message: types.Message, state: FSMContext):
                 message.from_user.id,
                 signature,
                 message_text,
-                message_type
+                message_type,
+                deliveries=delivered(results)
             )
 
         success_chats = len(sent_message_ids)
@@ -282,21 +282,24 @@ async def choose_subject_by_id(callback: types.CallbackQuery, state: FSMContext)
     
     async with pool.acquire() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("SELECT name, rK FROM subjects WHERE id=%s", (subject_id,))
+            await cur.execute("SELECT name, rK, clean_name, default_cabinet FROM subjects WHERE id=%s", (subject_id,))
             result = await cur.fetchone()
             
             if not result:
                 await callback.answer("❌ Предмет не найден в базе данных", show_alert=True)
                 return
             
-            subject_name, is_rk = result
+            subject_name, is_rk, clean_name, default_cabinet = result
+            _, clean_name, default_cabinet = subject_entry(subject_name, clean_name, default_cabinet)
     
     print(f"🔍 DEBUG choose_subject_by_id: предмет='{subject_name}', rK={is_rk}, ID={subject_id}")
     
     await state.update_data(
         subject=subject_name,
         subject_id=subject_id,
-        is_rk=is_rk
+        is_rk=is_rk,
+        clean_name=clean_name,
+        default_cabinet=default_cabinet
     )
     
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -383,25 +386,14 @@ async def choose_pair(callback: types.CallbackQuery, state: FSMContext):
             )
             await state.set_state(AddLessonState.cabinet)
         else:
-            cabinet_match = re.search(r'(\s+)(\d+\.?\d*[а-я]?|\d+\.?\d*/\d+\.?\d*|сп/з|актовый зал|спортзал)$', subject_name)
-            
-            if cabinet_match:
-                cabinet = cabinet_match.group(2)
-                clean_subject_name = subject_name.replace(cabinet_match.group(0), '').strip()
-            else:
-                cabinet = "Не указан"
-                clean_subject_name = subject_name
+            cabinet = data.get("default_cabinet") or "Не указан"
+            clean_subject_name = data.get("clean_name") or subject_name
             
             print(f"🔍 DEBUG: Сохраняем обычный предмет - кабинет: {cabinet}")
             
-            success_count = 0
-            for chat_id in ALLOWED_CHAT_IDS:
-                success = await save_rasp_modification(pool, chat_id, data["day"], data["week_type"], pair_number, subject_id, cabinet)
-                if success:
-                    success_count += 1
-                print(f"🔍 DEBUG: Модификация для чата {chat_id} - {'успешно' if success else 'ошибка'}")
-            
-            await save_static_rasp(pool, data["day"], data["week_type"], pair_number, subject_id, cabinet)
+            # Все чаты и статика - одной транзакцией: либо пара записана везде, либо нигде
+            success_count = await save_rasp_modifications(pool, ALLOWED_CHAT_IDS, data["day"], data["week_type"],
+                                                          pair_number, subject_id, cabinet, save_static=True)
             print(f"✅ Пара добавлена в статичное расписание: день={data['day']}, неделя={data['week_type']}, пара={pair_number}")
             
             display_name = clean_subject_name
@@ -444,14 +436,8 @@ async def set_cabinet(message: types.Message, state: FSMContext):
         
         print(f"🔍 DEBUG: Сохраняем rK предмет - день:{day}, неделя:{week_type}, пара:{pair_number}, предмет:{subject_name}, кабинет:{cabinet}")
         
-        success_count = 0
-        for chat_id in ALLOWED_CHAT_IDS:
-            success = await save_rasp_modification(pool, chat_id, day, week_type, pair_number, subject_id, cabinet)
-            if success:
-                success_count += 1
-            print(f"🔍 DEBUG: Модификация для чата {chat_id} - {'успешно' if success else 'ошибка'}")
-        
-        await save_static_rasp(pool, day, week_type, pair_number, subject_id, cabinet)
+        success_count = await save_rasp_modifications(pool, ALLOWED_CHAT_IDS, day, week_type,
+                                                      pair_number, subject_id, cabinet, save_static=True)
         print(f"✅ rK пара добавлена в статичное расписание: день={day}, неделя={week_type}, пара={pair_number}")
         
         await message.answer(
@@ -524,18 +510,7 @@ async def clear_pair_number(callback: types.CallbackQuery, state: FSMContext):
     data = await state.get_data()
 
     try:
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cur:
-                for chat_id in ALLOWED_CHAT_IDS:
-                    await cur.execute("""
-                        DELETE FROM rasp_modifications 
-                        WHERE chat_id=%s AND day=%s AND week_type=%s AND pair_number=%s
-                    """, (chat_id, data["day"], data["week_type"], pair_number))
-                    
-                    await cur.execute("""
-                        INSERT INTO rasp_modifications (chat_id, day, week_type, pair_number, subject_id, cabinet)
-                        VALUES (%s, %s, %s, %s, %s, %s)
-                    """, (chat_id, data["day"], data["week_type"], pair_number, None, "Очищено"))
+        await save_rasp_modifications(pool, ALLOWED_CHAT_IDS, data["day"], data["week_type"], pair_number, None, "Очищено")
 
         await callback.message.edit_text(
             f"✅ Пара {pair_number} ({DAYS[data['day']-1]}, неделя {data['week_type']}) очищена во всех чатах.",
@@ -666,7 +641,7 @@ async def confirm_clear_all_modifications(callback: types.CallbackQuery):
     try:
         week_type = int(callback.data.split("_")[3])
         
-        cleared_count = await clear_rasp_modifications(pool, week_type)
+        cleared_count = (await clear_rasp_modifications(pool, week_type))['modifications']
         
         week_name = "нечетной" if week_type == 1 else "четной"
         
@@ -756,7 +731,7 @@ async def confirm_clear_day_modifications(callback: types.CallbackQuery):
         week_type = int(parts[3])
         day = int(parts[4])
         
-        cleared_count = await clear_day_modifications(pool, week_type, day)
+        cleared_count = (await clear_day_modifications(pool, week_type, day))['modifications']
         
         day_name = DAYS[day-1]
         week_name = "нечетной" if week_type == 1 else "четной"
@@ -4,7 +4,9 @@ from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 import asyncio
 import datetime
+import io
 import re
+import tempfile
 from typing import List, Tuple
 
 from config import *
@@ -12,6 +14,10 @@ from database import *
 from states import *
 from keyboards import *
 from bot_init import dp, bot, pool  # Импортируем dp и bot
+from anekdoty import anekdot_deck, parse_anekdoty
+from sender import broadcast, delivered
+from middlewares import UserContext
+from handlers import menu_back_handler
 # ========== УСТАНОВКА КАБИНЕТОВ ==========
 
 @dp.callback_query(F.data == "admin_set_cabinet")
@@ -101,25 +107,7 @@ async def set_cabinet_final(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    async with pool.acquire() as conn:
-        async with conn.cursor() as cur:
-            for chat_id in ALLOWED_CHAT_IDS:
-                await cur.execute("""
-                    SELECT id FROM rasp_detailed
-                    WHERE chat_id=%s AND day=%s AND week_type=%s AND pair_number=%s
-                """, (chat_id, day, week_type, pair_number))
-                row = await cur.fetchone()
-                if row:
-                    await cur.execute("""
-                        UPDATE rasp_detailed
-                        SET cabinet=%s
-                        WHERE id=%s
-                    """, (cabinet, row[0]))
-                else:
-                    await cur.execute("""
-                        INSERT INTO rasp_detailed (chat_id, day, week_type, pair_number, cabinet)
-                        VALUES (%s, %s, %s, %s, %s)
-                    """, (chat_id, day, week_type, pair_number, cabinet))
+    await set_detailed_cabinet(pool, ALLOWED_CHAT_IDS, day, week_type, pair_number, cabinet)
     
     await message.answer(
         f"✅ Кабинет установлен для всех чатов!\n"
@@ -200,9 +188,15 @@ async def process_subject_type_choice(callback: types.CallbackQuery, state: FSMC
             await state.set_state(AddSubjectState.cabinet)
             
         elif subject_type == "rk":
+            clean_name, default_cabinet = split_subject_name(subject_name)
+            
             async with pool.acquire() as conn:
                 async with conn.cursor() as cur:
-                    await cur.execute("INSERT INTO subjects (name, rK) VALUES (%s, %s)", (subject_name, True))
+                    await cur.execute(
+                        "INSERT INTO subjects (name, rK, clean_name, default_cabinet) VALUES (%s, %s, %s, %s)",
+                        (subject_name, True, clean_name, default_cabinet)
+                    )
+                    rasp_model.set_subject(cur.lastrowid, subject_name, clean_name, default_cabinet)
             
             await callback.message.edit_text(
                 f"✅ Предмет добавлен!\n\n"
@@ -241,7 +235,11 @@ async def process_subject_cabinet(message: types.Message, state: FSMContext):
     
     async with pool.acquire() as conn:
         async with conn.cursor() as cur:
-            await cur.execute("INSERT INTO subjects (name, rK) VALUES (%s, %s)", (full_subject_name, False))
+            await cur.execute(
+                "INSERT INTO subjects (name, rK, clean_name, default_cabinet) VALUES (%s, %s, %s, %s)",
+                (full_subject_name, False, subject_name, cabinet)
+            )
+            rasp_model.set_subject(cur.lastrowid, full_subject_name, subject_name, cabinet)
     
     await message.answer(
         f"✅ Предмет добавлен!\n\n"
@@ -363,6 +361,8 @@ async def confirm_delete_subject(callback: types.CallbackQuery):
             await cur.execute("DELETE FROM homework WHERE subject_id=%s", (subject_id,))
             await cur.execute("DELETE FROM subjects WHERE id=%s", (subject_id,))
     
+    await load_rasp_model(pool)
+    
     await callback.message.edit_text(
         f"✅ Предмет '{subject_name}' и все связанные данные удалены."
     )
@@ -371,9 +371,9 @@ async def confirm_delete_subject(callback: types.CallbackQuery):
     await callback.answer()
 
 @dp.callback_query(F.data == "cancel_delete_subject")
-async def cancel_delete_subject(callback: types.CallbackQuery, state: FSMContext):
+async def cancel_delete_subject(callback: types.CallbackQuery, state: FSMContext, user_ctx: UserContext):
     await callback.message.edit_text("❌ Удаление отменено.")
-    await menu_back_handler(callback, state)
+    await menu_back_handler(callback, state, user_ctx)
     await callback.answer()
 
 # ========== СТАТИЧНОЕ РАСПИСАНИЕ ==========
@@ -498,6 +498,58 @@ async def process_special_user_signature(message: types.Message, state: FSMConte
     
     await state.clear()
 
+# ========== ИМПОРТ АНЕКДОТОВ ==========
+
+@dp.callback_query(F.data == "admin_import_anekdoty")
+async def admin_import_anekdoty_start(callback: types.CallbackQuery, state: FSMContext):
+    if callback.message.chat.type != "private" or callback.from_user.id not in ALLOWED_USERS:
+        await callback.answer("⛔ Только в ЛС админам", show_alert=True)
+        return
+
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="menu_admin")]
+    ])
+
+    await callback.message.edit_text(
+        "😂 Импорт анекдотов\n\n"
+        "Отправьте файл документом:\n"
+        "• .txt - анекдоты разделены пустой строкой\n"
+        "• .csv - колонка text (или первая колонка)\n"
+        "• .jsonl / .json - по строке на анекдот: \"текст\" или {\"text\": \"...\"}\n\n"
+        "Повторы уже имеющихся анекдотов пропускаются.",
+        reply_markup=kb
+    )
+    await state.set_state(ImportAnekdotyState.file)
+    await callback.answer()
+
+@dp.message(ImportAnekdotyState.file)
+async def process_import_anekdoty(message: types.Message, state: FSMContext):
+    if not message.document:
+        await message.answer("❌ Отправьте файл документом (.txt, .csv, .json, .jsonl):")
+        return
+    
+    file_name = message.document.file_name or "anekdoty.txt"
+    status = await message.answer("⏳ Загружаю и импортирую...")
+    
+    try:
+        with tempfile.TemporaryFile() as tmp:
+            await bot.download(message.document, destination=tmp)
+            tmp.seek(0)
+            
+            lines = io.TextIOWrapper(tmp, encoding="utf-8-sig", errors="replace", newline="")
+            counts = await import_anekdoty(pool, parse_anekdoty(lines, file_name))
+        
+        await status.edit_text(
+            f"✅ Импорт завершён\n\n"
+            f"➕ Добавлено: {counts['added']}\n"
+            f"♻ Дубликатов пропущено: {counts['duplicates']}\n"
+            f"📚 Всего анекдотов: {len(anekdot_deck.texts)}"
+        )
+    except Exception as e:
+        await status.edit_text(f"❌ Ошибка импорта: {e}")
+    
+    await state.clear()
+
 # ========== УДАЛЕНИЕ СООБЩЕНИЙ ПРЕПОДАВАТЕЛЕЙ ==========
 
 @dp.callback_query(F.data == "admin_delete_teacher_message")
@@ -583,6 +635,7 @@ async def process_delete_teacher_message(callback: types.CallbackQuery, state: F
         
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="✅ Да, удалить", callback_data=f"confirm_delete_msg_{message_db_id}")],
+            [InlineKeyboardButton(text="✏️ Изменить текст", callback_data=f"edit_teacher_msg_{message_db_id}")],
             [InlineKeyboardButton(text="❌ Нет, отменить", callback_data="menu_admin_from_delete")]
         ])
                 
@@ -605,11 +658,19 @@ async def confirm_delete_teacher_message(callback: types.CallbackQuery):
     try:
         message_db_id = int(callback.data[len("confirm_delete_msg_"):])
         
+        # Удаляем копии во всех чатах: один delete_messages на чат, чаты параллельно
+        deliveries = await get_teacher_message_deliveries(pool, message_db_id)
+        results = await broadcast(
+            deliveries,
+            lambda chat_id: bot.delete_messages(chat_id, deliveries[chat_id])
+        )
+        
         success = await delete_teacher_message(pool, message_db_id)
         
         if success:
             await callback.message.edit_text(
-                "✅ Сообщение преподавателя успешно удалено из базы данных.\n\n"
+                "✅ Сообщение преподавателя удалено из базы данных.\n"
+                f"🧹 Удалено из бесед: {len(delivered(results))} из {len(deliveries)}\n\n"
                 "⚙ Админ-панель:",
                 reply_markup=admin_menu()
             )
@@ -629,7 +690,76 @@ async def confirm_delete_teacher_message(callback: types.CallbackQuery):
     
     await callback.answer()
 
+@dp.callback_query(F.data.startswith("edit_teacher_msg_"))
+async def edit_teacher_message_start(callback: types.CallbackQuery, state: FSMContext):
+    if callback.message.chat.type != "private" or callback.from_user.id not in ALLOWED_USERS:
+        await callback.answer("⛔ Только в ЛС админам", show_alert=True)
+        return
+    
+    message_db_id = int(callback.data[len("edit_teacher_msg_"):])
+    
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Отмена", callback_data="menu_admin_from_delete")]
+    ])
+    
+    await callback.message.edit_text(
+        "✏️ Введите новый текст сообщения (для медиа - новую подпись).\n"
+        "Подпись преподавателя добавится автоматически:",
+        reply_markup=kb
+    )
+    await state.update_data(teacher_message_id=message_db_id)
+    await state.set_state(EditTeacherMessageState.text)
+    await callback.answer()
+
+@dp.message(EditTeacherMessageState.text)
+async def process_edit_teacher_message(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    message_db_id = data["teacher_message_id"]
+    new_text = (message.text or "").strip()
+    
+    if not new_text or new_text.startswith('/'):
+        await message.answer("❌ Введите текст (не начинающийся с /):")
+        return
+    
+    try:
+        async with pool.acquire() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("SELECT signature, message_type FROM teacher_messages WHERE id = %s", (message_db_id,))
+                row = await cur.fetchone()
+        
+        if not row:
+            await message.answer("❌ Сообщение не найдено", reply_markup=admin_menu())
+            await state.clear()
+            return
+        
+        signature, msg_type = row
+        if msg_type == "sticker":
+            await message.answer("❌ Стикер нельзя изменить", reply_markup=admin_menu())
+            await state.clear()
+            return
+        
+        full_text = f"Сообщение от {signature}: {new_text}"
+        deliveries = await get_teacher_message_deliveries(pool, message_db_id)
+        
+        # У альбома подпись стоит на первом элементе
+        if msg_type == "text":
+            edit = lambda chat_id: bot.edit_message_text(text=full_text, chat_id=chat_id, message_id=deliveries[chat_id][0])
+        else:
+            edit = lambda chat_id: bot.edit_message_caption(caption=full_text, chat_id=chat_id, message_id=deliveries[chat_id][0])
+        
+        results = await broadcast(deliveries, edit)
+        await update_teacher_message_text(pool, message_db_id, new_text)
+        
+        await message.answer(
+            f"✅ Сообщение изменено в {len(delivered(results))} из {len(deliveries)} бесед",
+            reply_markup=admin_menu()
+        )
+    except Exception as e:
+        await message.answer(f"❌ Ошибка при изменении: {e}", reply_markup=admin_menu())
+    
+    await state.clear()
+
 @dp.callback_query(F.data == "cancel_delete_msg")
-async def cancel_delete_teacher_message(callback: types.CallbackQuery):
-    await menu_back_handler(callback, None)
+async def cancel_delete_teacher_message(callback: types.CallbackQuery, state: FSMContext, user_ctx: UserContext):
+    await menu_back_handler(callback, state, user_ctx)
     await callback.answer()
\ No newline at end of file
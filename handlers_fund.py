@@ -249,8 +249,9 @@ async def process_balance_change(message: types.Message, state: FSMContext):
         print(f"🔍 DEBUG: amount={amount}, current_balance={current_balance}, type_current={type(current_balance)}")
         print(f"🔍 DEBUG: member_id={member_id}, member_name={member_name}")
         
-        await update_member_balance(pool, member_id, amount)
-        await update_fund_balance(pool, amount)
+        async with db_transaction(pool):
+            await update_member_balance(pool, member_id, amount)
+            await update_fund_balance(pool, amount)
         
         async with pool.acquire() as conn:
             async with conn.cursor() as cur:
@@ -54,6 +54,8 @@ def admin_menu():
         [InlineKeyboardButton(text="👤 Добавить спец-пользователя", callback_data="admin_add_special_user")],
         [InlineKeyboardButton(text="🗑️ Удалить сообщение преподавателя", callback_data="admin_delete_teacher_message")],
         
+        [InlineKeyboardButton(text="😂 Импорт анекдотов", callback_data="admin_import_anekdoty")],
+        
         [InlineKeyboardButton(text="📋 Все команды", callback_data="admin_commands")],
         
         [InlineKeyboardButton(text="⬅ Назад", callback_data="menu_back")]
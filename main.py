@@ -5,8 +5,10 @@ from apscheduler.triggers.cron import CronTrigger
 
 from config import *
 from database import *
+from migrations import run_migrations
 from bot_init import dp, bot, pool, scheduler  # Импортируем из bot_init
-from scheduler_functions import send_today_rasp, check_birthdays  # Импортируем из нового файла
+from middlewares import UserContextMiddleware, ThrottlingMiddleware
+from scheduler_functions import prerender_publication, publish_slot, send_week_digest, check_birthdays  # Импортируем из нового файла
 
 # Импортируем все обработчики (чтобы они зарегистрировались)
 import handlers
@@ -15,28 +17,39 @@ import handlers_admin2
 import handlers_homework
 import handlers_fund
 
-from database import get_current_week_type, clear_rasp_modifications
+from database import rollover_week_type
 
 # ========== ФУНКЦИИ ПЛАНИРОВЩИКА ==========
 
 async def reset_rasp_for_new_week():
     try:
-        current_week = await get_current_week_type(pool)
-        previous_week = 2 if current_week == 1 else 1
-        
-        await clear_rasp_modifications(pool, previous_week)
-        print(f"✅ Сброшены модификации расписания для недели {previous_week}")
-        
+        await rollover_week_type(pool)
     except Exception as e:
         print(f"❌ Ошибка при сбросе расписания: {e}")
 
+async def sweep_orphan_chats():
+    """Чистит расписание чатов, убранных из ALLOWED_CHAT_IDS"""
+    if not ALLOWED_CHAT_IDS:
+        return
+    try:
+        deleted_counts = await purge_orphan_chats(pool, ALLOWED_CHAT_IDS)
+        if any(deleted_counts.values()):
+            print(f"🧹 Удалены строки отключенных чатов: {deleted_counts['modifications']} модификаций, "
+                  f"{deleted_counts['rasp_detailed']} детализированных пар")
+    except Exception as e:
+        print(f"❌ Ошибка при чистке отключенных чатов: {e}")
+
 def _job_id_for_time(hour: int, minute: int) -> str:
     return f"publish_{hour:02d}_{minute:02d}"
 
+def _prerender_time(hour: int, minute: int):
+    total = (hour * 60 + minute - PRERENDER_MINUTES) % (24 * 60)
+    return total // 60, total % 60
+
 async def reschedule_publish_jobs():
     try:
         for job in list(scheduler.get_jobs()):
-            if job.id.startswith("publish_"):
+            if job.id.startswith(("publish_", "prerender_")):
                 try:
                     scheduler.remove_job(job.id)
                 except Exception:
@@ -49,9 +62,18 @@ async def reschedule_publish_jobs():
         pid, hour, minute = row
         job_id = _job_id_for_time(hour, minute)
         try:
-            scheduler.add_job(send_today_rasp, CronTrigger(hour=hour, minute=minute, timezone=TZ), id=job_id)
+            scheduler.add_job(publish_slot, CronTrigger(hour=hour, minute=minute, timezone=TZ),
+                              args=(hour, minute), id=job_id)
         except Exception:
             pass
+        
+        if PRERENDER_MINUTES > 0:
+            pre_hour, pre_minute = _prerender_time(hour, minute)
+            try:
+                scheduler.add_job(prerender_publication, CronTrigger(hour=pre_hour, minute=pre_minute, timezone=TZ),
+                                  args=(hour, minute), id=f"prerender_{hour:02d}_{minute:02d}")
+            except Exception:
+                pass
 
 # ========== ОСНОВНАЯ ФУНКЦИЯ ==========
 
@@ -64,19 +86,30 @@ async def main():
         pool = await get_pool()
         print("✅ Подключение к базе данных установлено")
         
-        await init_db(pool)
-        print("✅ База данных инициализирована")
-        
-        await ensure_columns(pool)
-        await ensure_birthday_columns(pool)
-        print("✅ Проверка структуры базы данных завершена")
+        schema_version = await run_migrations(pool)
+        print(f"✅ Структура базы данных актуальна (версия схемы {schema_version})")
         
         await load_special_users(pool)
         
+        # Троттлинг только для нажатий и первым: отброшенные нажатия не доходят до запросов
+        # контекста пользователя. Сообщения (ввод в FSM, пересылка преподавателя) не режем
+        dp.callback_query.middleware(ThrottlingMiddleware())
+        user_context = UserContextMiddleware(pool)
+        for observer in (dp.message, dp.callback_query):
+            observer.middleware(user_context)
+        
+        await load_rasp_model(pool)
+        await load_anekdoty(pool)
+        
+        # Если бот был выключен в понедельник, догоняем смену недели
+        await reset_rasp_for_new_week()
+        
         await reschedule_publish_jobs()
         
         scheduler.add_job(check_birthdays, CronTrigger(hour=9, minute=0, timezone=TZ))
         scheduler.add_job(reset_rasp_for_new_week, CronTrigger(hour=0, minute=0, timezone=TZ))
+        scheduler.add_job(send_week_digest, CronTrigger(day_of_week="sun", hour=19, minute=0, timezone=TZ))
+        scheduler.add_job(sweep_orphan_chats, CronTrigger(hour=3, minute=30, timezone=TZ))
         
         scheduler.start()
         print("✅ Планировщик задач запущен")
@@ -0,0 +1,125 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.flags import get_flag
+from aiogram.types import CallbackQuery, TelegramObject
+
+from config import ALLOWED_USERS, FUND_MANAGER_USER_ID, THROTTLING_RATES, THROTTLING_CHAT_RATE, THROTTLING_TTL
+from database import get_user_profile
+
+
+class UserContext:
+    """Никнейм и роли пользователя, вычисленные один раз на апдейт"""
+
+    __slots__ = ("user_id", "nickname", "signature", "is_admin", "is_fund_manager")
+
+    def __init__(self, user_id: int, nickname, signature):
+        self.user_id = user_id
+        self.nickname = nickname
+        self.signature = signature
+        self.is_admin = user_id in ALLOWED_USERS
+        self.is_fund_manager = user_id == FUND_MANAGER_USER_ID
+
+    @property
+    def is_special_user(self) -> bool:
+        return self.signature is not None
+
+
+class UserContextMiddleware(BaseMiddleware):
+    """Кладёт в data["user_ctx"] контекст автора апдейта (кэш get_user_profile)"""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        data["user_ctx"] = None
+
+        if user is not None:
+            try:
+                nickname, signature = await get_user_profile(self.pool, user.id)
+                data["user_ctx"] = UserContext(user.id, nickname, signature)
+            except Exception as e:
+                print(f"Ошибка получения контекста пользователя {user.id}: {e}")
+
+        return await handler(event, data)
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "rate", "tokens", "updated_at")
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = now
+
+    def consume(self, now: float) -> bool:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Token bucket на пользователя и на групповой чат.
+
+    Лишние нажатия отбрасываются до обработчика (и до запросов к БД).
+    Корзины, не использовавшиеся THROTTLING_TTL секунд, удаляются.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.last_sweep = time.monotonic()
+
+    def _bucket(self, key, capacity: float, rate: float, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(capacity, rate, now)
+        return bucket
+
+    def _sweep(self, now: float):
+        if now - self.last_sweep < THROTTLING_TTL:
+            return
+        self.last_sweep = now
+        for key in [k for k, b in self.buckets.items() if now - b.updated_at > THROTTLING_TTL]:
+            del self.buckets[key]
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        user = data.get("event_from_user")
+        chat = data.get("event_chat")
+        if user is None:
+            return await handler(event, data)
+        
+        group = get_flag(data, "throttling", default="default")
+        capacity, rate = THROTTLING_RATES.get(group, THROTTLING_RATES["default"])
+
+        now = time.monotonic()
+        self._sweep(now)
+
+        allowed = self._bucket(("user", group, user.id), capacity, rate, now).consume(now)
+        if allowed and chat is not None and chat.type != "private":
+            allowed = self._bucket(("chat", chat.id), *THROTTLING_CHAT_RATE, now=now).consume(now)
+
+        if allowed:
+            return await handler(event, data)
+
+        if isinstance(event, CallbackQuery):
+            try:
+                await event.answer("⏳ Подождите немного...", show_alert=False)
+            except Exception:
+                pass
+        return None
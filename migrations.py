@@ -0,0 +1,311 @@
+import aiomysql
+
+from db_pool import db_connection
+from rasp_model import split_subject_name
+
+# Ошибка MySQL "таблица не существует"
+ER_NO_SUCH_TABLE = 1146
+
+
+async def _has_column(cur, table: str, column: str) -> bool:
+    await cur.execute(f"SHOW COLUMNS FROM {table} LIKE %s", (column,))
+    return await cur.fetchone() is not None
+
+
+async def _has_index(cur, table: str, index_name: str) -> bool:
+    await cur.execute(f"SHOW INDEX FROM {table} WHERE Key_name = %s", (index_name,))
+    return bool(await cur.fetchall())
+
+
+async def _add_column(cur, table: str, column: str, definition: str):
+    if not await _has_column(cur, table, column):
+        await cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        print(f"✅ Добавлена колонка {column} в таблицу {table}")
+
+
+async def _add_index(cur, table: str, index_name: str, columns: str):
+    if not await _has_index(cur, table, index_name):
+        await cur.execute(f"ALTER TABLE {table} ADD INDEX {index_name} ({columns})")
+        print(f"✅ Добавлен индекс {index_name} в таблицу {table}")
+
+
+async def _add_unique_key(cur, table: str, index_name: str, columns: str, replaces: str = None):
+    """Уникальный ключ на columns: дубли удаляются (остаётся строка с наибольшим id),
+    обычный индекс replaces на тех же колонках больше не нужен"""
+    if not await _has_index(cur, table, index_name):
+        join_on = " AND ".join(f"d.{c} = k.{c}" for c in (c.strip() for c in columns.split(",")))
+        await cur.execute(f"DELETE d FROM {table} d JOIN {table} k ON {join_on} AND d.id < k.id")
+        if cur.rowcount:
+            print(f"🧹 Удалено дублей в {table}: {cur.rowcount}")
+        await cur.execute(f"ALTER TABLE {table} ADD UNIQUE KEY {index_name} ({columns})")
+        print(f"✅ Добавлен уникальный ключ {index_name} в таблицу {table}")
+
+    if replaces and await _has_index(cur, table, replaces):
+        await cur.execute(f"ALTER TABLE {table} DROP INDEX {replaces}")
+
+
+# ========== ШАГИ МИГРАЦИЙ ==========
+# Каждый шаг идемпотентен: на базе, созданной до появления schema_version,
+# уже сделанные изменения просто пропускаются.
+
+async def initial_schema(cur):
+    # subjects раньше таблиц, которые ссылаются на неё внешним ключом
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS subjects (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            rK BOOLEAN DEFAULT FALSE,
+            clean_name VARCHAR(255),
+            default_cabinet VARCHAR(50)
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS rasp (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            chat_id BIGINT,
+            day INT,
+            week_type INT,
+            text TEXT
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS birthdays (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_name VARCHAR(255) NOT NULL,
+            birth_date DATE NOT NULL,
+            added_by_user_id BIGINT,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS nicknames (
+            user_id BIGINT PRIMARY KEY,
+            nickname VARCHAR(255)
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS static_rasp (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            day INT,
+            week_type INT,
+            pair_number INT,
+            subject_id INT,
+            cabinet VARCHAR(50),
+            FOREIGN KEY (subject_id) REFERENCES subjects(id)
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS rasp_modifications (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            chat_id BIGINT,
+            day INT,
+            week_type INT,
+            pair_number INT,
+            subject_id INT,
+            cabinet VARCHAR(50),
+            modified_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (subject_id) REFERENCES subjects(id)
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS publish_times (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            hour INT NOT NULL,
+            minute INT NOT NULL
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS anekdoty (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            text TEXT NOT NULL
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS special_users (
+            user_id BIGINT PRIMARY KEY,
+            signature VARCHAR(255) NOT NULL
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS rasp_detailed (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            chat_id BIGINT,
+            day INT,
+            week_type INT,
+            pair_number INT,
+            subject_id INT,
+            cabinet VARCHAR(50),
+            FOREIGN KEY (subject_id) REFERENCES subjects(id)
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS current_week_type (
+            chat_id BIGINT PRIMARY KEY,
+            week_type INT NOT NULL DEFAULT 1,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS week_setting (
+            chat_id BIGINT PRIMARY KEY,
+            week_type INT NOT NULL DEFAULT 1
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS teacher_messages (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            message_id BIGINT,
+            from_user_id BIGINT,
+            signature VARCHAR(255),
+            message_text TEXT,
+            message_type VARCHAR(50),
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS teacher_message_deliveries (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            teacher_message_id INT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            message_id BIGINT NOT NULL,
+            INDEX idx_teacher_message (teacher_message_id, chat_id)
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS group_fund_balance (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            current_balance DECIMAL(10, 2) DEFAULT 0.00,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS group_fund_members (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            full_name VARCHAR(255) NOT NULL,
+            balance DECIMAL(10, 2) DEFAULT 0.00,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS group_fund_purchases (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            item_name VARCHAR(255) NOT NULL,
+            item_url VARCHAR(500),
+            price DECIMAL(10, 2) NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE
+        )""")
+    await cur.execute("""
+        CREATE TABLE IF NOT EXISTS homework (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            subject_id INT,
+            due_date DATE,
+            task_text TEXT NOT NULL,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (subject_id) REFERENCES subjects(id)
+        )""")
+
+
+async def week_setting_set_at(cur):
+    await _add_column(cur, "week_setting", "set_at", "DATE")
+
+
+async def birthday_added_by(cur):
+    await _add_column(cur, "birthdays", "added_by_user_id", "BIGINT")
+
+
+async def subject_clean_name(cur):
+    await _add_column(cur, "subjects", "clean_name", "VARCHAR(255)")
+    await _add_column(cur, "subjects", "default_cabinet", "VARCHAR(50)")
+
+    # Разовое заполнение для предметов, добавленных до появления колонок
+    await cur.execute("SELECT id, name FROM subjects WHERE clean_name IS NULL")
+    rows = await cur.fetchall()
+    if rows:
+        updates = []
+        for subject_id, name in rows:
+            clean_name, default_cabinet = split_subject_name(name)
+            updates.append((clean_name, default_cabinet, subject_id))
+        await cur.executemany(
+            "UPDATE subjects SET clean_name=%s, default_cabinet=%s WHERE id=%s",
+            updates
+        )
+        print(f"✅ Заполнены clean_name/default_cabinet для {len(updates)} предметов")
+
+
+# (таблица, индекс, колонки) под WHERE горячих запросов database.py
+HOT_INDEXES = [
+    # chat_id+week_type (неделя, сброс), +day (день чата), day+week_type+chat_id IN (рассылка)
+    ("rasp_modifications", "idx_mod_chat_week_day", "chat_id, week_type, day, pair_number"),
+    ("rasp_detailed", "idx_detailed_chat_week_day", "chat_id, week_type, day, pair_number"),
+    ("static_rasp", "idx_static_week_day", "week_type, day, pair_number"),
+    ("homework", "idx_homework_due_date", "due_date"),
+    ("birthdays", "idx_birthdays_md", "birth_md"),
+    ("teacher_messages", "idx_teacher_created_at", "created_at"),
+    ("group_fund_purchases", "idx_purchases_active_created", "is_active, created_at"),
+]
+
+
+async def hot_indexes(cur):
+    # Месяц и день рождения (MMDD) хранятся отдельно: именинники ищутся по индексу, а не DATE_FORMAT по всей таблице
+    await _add_column(cur, "birthdays", "birth_md",
+                      "SMALLINT AS (MONTH(birth_date) * 100 + DAYOFMONTH(birth_date)) STORED")
+
+    for table, index_name, columns in HOT_INDEXES:
+        await _add_index(cur, table, index_name, columns)
+
+
+async def rasp_unique_keys(cur):
+    # Одна пара - одна строка: запись расписания становится upsert'ом (ON DUPLICATE KEY UPDATE)
+    await _add_unique_key(cur, "rasp_modifications", "uq_mod_chat_week_day_pair",
+                          "chat_id, week_type, day, pair_number", replaces="idx_mod_chat_week_day")
+    await _add_unique_key(cur, "static_rasp", "uq_static_week_day_pair",
+                          "week_type, day, pair_number", replaces="idx_static_week_day")
+    await _add_unique_key(cur, "rasp_detailed", "uq_detailed_chat_week_day_pair",
+                          "chat_id, week_type, day, pair_number", replaces="idx_detailed_chat_week_day")
+
+
+async def week_indexes(cur):
+    # Сброс недели/дня удаляет по всем чатам сразу: WHERE week_type[, day] без chat_id.
+    # Чистке удалённых чатов (chat_id NOT IN) хватает уникальных ключей с chat_id в начале
+    await _add_index(cur, "rasp_modifications", "idx_mod_week_day", "week_type, day")
+    await _add_index(cur, "rasp_detailed", "idx_detailed_week_day", "week_type, day")
+
+
+# Упорядоченный список миграций: (версия, описание, шаг). Новые - только в конец.
+MIGRATIONS = [
+    (1, "начальная схема", initial_schema),
+    (2, "week_setting.set_at", week_setting_set_at),
+    (3, "birthdays.added_by_user_id", birthday_added_by),
+    (4, "subjects.clean_name/default_cabinet", subject_clean_name),
+    (5, "индексы горячих запросов и birthdays.birth_md", hot_indexes),
+    (6, "уникальные ключи пар расписания", rasp_unique_keys),
+    (7, "индексы сброса недели по всем чатам", week_indexes),
+]
+
+
+async def get_schema_version(cur) -> int:
+    try:
+        await cur.execute("SELECT MAX(version) FROM schema_version")
+    except aiomysql.ProgrammingError as e:
+        if e.args[0] != ER_NO_SUCH_TABLE:
+            raise
+        await cur.execute("""
+            CREATE TABLE schema_version (
+                version INT PRIMARY KEY,
+                description VARCHAR(255),
+                applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )""")
+        return 0
+
+    row = await cur.fetchone()
+    return row[0] or 0
+
+
+async def run_migrations(pool) -> int:
+    """Применяет недостающие миграции и возвращает версию схемы.
+
+    На уже обновлённой базе это один SELECT MAX(version) - без DDL и SHOW COLUMNS.
+    DDL в MySQL не откатывается, поэтому версия записывается после каждого шага:
+    упавшая миграция при следующем запуске повторится с того же места.
+    """
+    async with db_connection(pool) as conn:
+        async with conn.cursor() as cur:
+            version = await get_schema_version(cur)
+
+            for step_version, description, step in MIGRATIONS:
+                if step_version <= version:
+                    continue
+                await step(cur)
+                await cur.execute(
+                    "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                    (step_version, description)
+                )
+                version = step_version
+                print(f"✅ Миграция {step_version}: {description}")
+
+    return version
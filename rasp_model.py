@@ -0,0 +1,268 @@
+import datetime
+import re
+import time
+from collections import OrderedDict
+
+from config import RASP_CACHE_SIZE, RASP_CACHE_TTL
+
+# Кабинет в конце названия предмета: "Математика 305", "Физра сп/з" и т.п.
+SUBJECT_CABINET_RE = re.compile(r'(\s+)(\d+\.?\d*[а-я]?|\d+\.?\d*/\d+\.?\d*|сп/з|актовый зал|спортзал)$')
+
+
+class RenderCache:
+    """LRU/TTL кэш готовых текстов расписания по ключу (chat_id, day, week_type, date)"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, key):
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        expires_at, text = item
+        if expires_at < time.monotonic():
+            del self._items[key]
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(key)
+        self.hits += 1
+        return text
+
+    def put(self, key, text: str):
+        self._items[key] = (time.monotonic() + self.ttl, text)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(self, chat_id: int = None, day: int = None, week_type: int = None, dates=None):
+        """Удаляет записи, подходящие под все заданные условия"""
+        for key in list(self._items):
+            key_chat_id, key_day, key_week_type, key_date = key
+            if chat_id is not None and key_chat_id != chat_id:
+                continue
+            if day is not None and key_day != day:
+                continue
+            if week_type is not None and key_week_type != week_type:
+                continue
+            if dates is not None and key_date not in dates:
+                continue
+            del self._items[key]
+
+    def clear(self):
+        self._items.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+
+class RaspModel:
+    """Расписание в памяти процесса: статика, модификации чатов, предметы и даты ДЗ.
+
+    Загружается один раз при старте (database.load_rasp_model), каждый writer
+    в database.py обновляет нужный кусок и поднимает version.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.loaded = False
+        # (day, week_type) -> {pair_number: (subject_id, cabinet)}
+        self.static_pairs = {}
+        # (chat_id, day, week_type) -> {pair_number: (subject_id, cabinet)}
+        self.modifications = {}
+        # subject_id -> (name, clean_name, default_cabinet)
+        self.subjects = {}
+        # даты, на которые есть домашнее задание
+        self.homework_dates = set()
+        self.render_cache = RenderCache(RASP_CACHE_SIZE, RASP_CACHE_TTL)
+
+    def _bump(self):
+        self.version += 1
+
+    def touch(self):
+        """Поднимает version без изменения данных (например, при смене четности недели)"""
+        self._bump()
+
+    def load(self, static_rows, modification_rows, subject_rows, homework_dates):
+        static_pairs = {}
+        for day, week_type, pair_number, subject_id, cabinet in static_rows:
+            static_pairs.setdefault((day, week_type), {})[pair_number] = (subject_id, cabinet)
+
+        modifications = {}
+        for chat_id, day, week_type, pair_number, subject_id, cabinet in modification_rows:
+            modifications.setdefault((chat_id, day, week_type), {})[pair_number] = (subject_id, cabinet)
+
+        self.static_pairs = static_pairs
+        self.modifications = modifications
+        self.subjects = {
+            subject_id: subject_entry(name, clean_name, default_cabinet)
+            for subject_id, name, clean_name, default_cabinet in subject_rows
+        }
+        self.homework_dates = set(homework_dates)
+        self.loaded = True
+        self.render_cache.clear()
+        self._bump()
+
+    # ---------- статичное расписание ----------
+
+    def set_static(self, day: int, week_type: int, pair_number: int, subject_id: int, cabinet: str):
+        self.static_pairs.setdefault((day, week_type), {})[pair_number] = (subject_id, cabinet)
+        self.render_cache.invalidate(day=day, week_type=week_type)
+        self._bump()
+
+    def clear_static(self, week_type: int):
+        for key in [k for k in self.static_pairs if k[1] == week_type]:
+            del self.static_pairs[key]
+        self.render_cache.invalidate(week_type=week_type)
+        self._bump()
+
+    def replace_static_week(self, week_type: int, rows):
+        """Заменяет статику недели строками (day, pair_number, subject_id, cabinet)"""
+        for key in [k for k in self.static_pairs if k[1] == week_type]:
+            del self.static_pairs[key]
+        for day, pair_number, subject_id, cabinet in rows:
+            self.static_pairs.setdefault((day, week_type), {})[pair_number] = (subject_id, cabinet)
+        self.render_cache.invalidate(week_type=week_type)
+        self._bump()
+
+    # ---------- модификации ----------
+
+    def set_modification(self, chat_id: int, day: int, week_type: int, pair_number: int, subject_id, cabinet):
+        self.modifications.setdefault((chat_id, day, week_type), {})[pair_number] = (subject_id, cabinet)
+        self.render_cache.invalidate(chat_id=chat_id, day=day, week_type=week_type)
+        self._bump()
+
+    def clear_modifications(self, week_type: int, day: int = None, chat_ids=None):
+        for key in list(self.modifications):
+            chat_id, mod_day, mod_week_type = key
+            if mod_week_type != week_type:
+                continue
+            if day is not None and mod_day != day:
+                continue
+            if chat_ids is not None and chat_id not in chat_ids:
+                continue
+            del self.modifications[key]
+            self.render_cache.invalidate(chat_id=chat_id, day=mod_day, week_type=week_type)
+        self._bump()
+
+    def retain_chats(self, chat_ids):
+        """Убирает модификации чатов, которых нет в chat_ids"""
+        chat_ids = set(chat_ids)
+        for key in [k for k in self.modifications if k[0] not in chat_ids]:
+            del self.modifications[key]
+            self.render_cache.invalidate(chat_id=key[0])
+        self._bump()
+
+    # ---------- предметы и ДЗ ----------
+
+    def set_subject(self, subject_id: int, name: str, clean_name: str, default_cabinet):
+        # Новый предмет ещё не стоит ни в одном дне - кэш сбрасывать не нужно
+        self.subjects[subject_id] = (name, clean_name, default_cabinet)
+        self._bump()
+
+    def set_homework_dates(self, dates):
+        dates = set(dates)
+        changed = dates ^ self.homework_dates
+        self.homework_dates = dates
+        if changed:
+            self.render_cache.invalidate(dates=changed)
+        self._bump()
+
+    # ---------- чтение ----------
+
+    def get_day(self, chat_id: int, day: int, week_type: int):
+        """Возвращает (статичные пары, модификации чата) для дня"""
+        static_pairs = self.static_pairs.get((day, week_type), {})
+        modified_pairs = self.modifications.get((chat_id, day, week_type), {})
+        return static_pairs, modified_pairs
+
+    def has_homework(self, date: datetime.date) -> bool:
+        return date in self.homework_dates
+
+
+rasp_model = RaspModel()
+
+
+def split_subject_name(name: str):
+    """Отделяет кабинет от названия: "Математика 305" -> ("Математика", "305")"""
+    cabinet_match = SUBJECT_CABINET_RE.search(name)
+    if not cabinet_match:
+        return name.strip(), None
+    return name[:cabinet_match.start()].strip(), cabinet_match.group(2)
+
+
+def subject_entry(name: str, clean_name, default_cabinet):
+    # Старые строки без clean_name (до миграции) разбираем один раз при загрузке
+    if clean_name is None:
+        clean_name, default_cabinet = split_subject_name(name)
+    return name, clean_name, default_cabinet
+
+
+def _format_pair(i: int, subject, cabinet, mark: str) -> str:
+    _, clean_name, default_cabinet = subject
+
+    if not cabinet or cabinet == "Не указан":
+        cabinet = default_cabinet
+
+    if cabinet:
+        return f"{i}. {cabinet} {clean_name}{mark}"
+    return f"{i}. {clean_name}{mark}"
+
+
+def format_rasp_day(static_pairs: dict, modified_pairs: dict, subjects: dict, has_hw: bool) -> str:
+    """Собирает текст расписания дня из статики, модификаций и справочника предметов"""
+    # Статичная пара без предмета в справочнике не показывается (как при JOIN subjects)
+    static_pairs = {n: v for n, v in static_pairs.items() if v[0] in subjects}
+
+    all_pairs = set(static_pairs) | set(modified_pairs)
+    if not all_pairs:
+        return "Расписание пустое."
+
+    msg_lines = []
+    has_modifications = False
+
+    for i in range(1, max(all_pairs) + 1):
+        if i in modified_pairs:
+            subject_id, cabinet = modified_pairs[i]
+            has_modifications = True
+
+            subject = subjects.get(subject_id) if subject_id else None
+            if subject is None or subject[0] == "Свободно":
+                line = f"{i}. Свободно 🔄"
+            else:
+                line = _format_pair(i, subject, cabinet, " 🔄")
+
+        elif i in static_pairs:
+            subject_id, cabinet = static_pairs[i]
+            subject = subjects[subject_id]
+
+            if subject[0] == "Свободно":
+                line = f"{i}. Свободно"
+            else:
+                line = _format_pair(i, subject, cabinet, "")
+        else:
+            line = f"{i}. Свободно"
+
+        msg_lines.append(line)
+
+    result = "\n".join(msg_lines)
+
+    if has_hw:
+        result += "\n\n📚 Есть заданное домашнее задание"
+
+    if has_modifications:
+        result += "\n\n🔄 Отмечены измененные пары"
+
+    return result
@@ -3,75 +3,143 @@ import asyncio
 from config import *
 from database import *
 from bot_init import bot, pool
+from sender import bulk, broadcast, delivered
 
-async def send_today_rasp():
+DAY_NAMES = {
+    1: "Понедельник", 2: "Вторник", 3: "Среда",
+    4: "Четверг", 5: "Пятница", 6: "Суббота"
+}
+
+def publication_target(now: datetime.datetime):
+    """День, на который публикуется расписание: (target_date, day_to_post, day_name, next_week)"""
+    today = now.date()
+    
+    # После 18:00 публикуем на завтра, воскресенье пропускаем
+    if now.hour >= 18:
+        target_date = today + datetime.timedelta(days=1)
+        sunday_name = "послезавтра (Понедельник)"
+        day_name = "завтра"
+    else:
+        target_date = today
+        sunday_name = "завтра (Понедельник)"
+        day_name = "сегодня"
+    
+    if target_date.isoweekday() == 7:
+        target_date += datetime.timedelta(days=1)
+        day_name = sunday_name
+    
+    # Понедельник, опубликованный заранее, относится уже к следующей неделе
+    next_week = target_date.isoweekday() == 1 and target_date != today
+    
+    return target_date, target_date.isoweekday(), day_name, next_week
+
+async def build_today_publications(now: datetime.datetime = None) -> dict:
+    """Готовые тексты публикации для всех чатов: {chat_id: message}"""
+    if now is None:
+        now = datetime.datetime.now(TZ)
+    
+    target_date, day_to_post, day_name, next_week = publication_target(now)
+    
+    week_type = await get_current_week_type(pool)
+    if next_week:
+        week_type = 2 if week_type == 1 else 1
+    week_name = "нечетная" if week_type == 1 else "четная"
+    
+    if "(" in day_name and ")" in day_name:
+        header = f"📅 Расписание на {day_name} | Неделя: {week_name}"
+    else:
+        header = f"📅 Расписание на {day_name} ({DAY_NAMES[day_to_post]}) | Неделя: {week_name}"
+    
+    # Чаты с одинаковыми модификациями получают один и тот же текст - рендерим его один раз
+    groups = await group_chats_by_overlay(pool, ALLOWED_CHAT_IDS, day_to_post, week_type)
+    
+    texts = {}
+    for chat_ids in groups:
+        text = await get_rasp_formatted(day_to_post, week_type, chat_ids[0], target_date, pool=pool)
+        for chat_id in chat_ids:
+            texts[chat_id] = text
+    
+    messages = {}
     for chat_id in ALLOWED_CHAT_IDS:
-        try:
-            now = datetime.datetime.now(TZ)
-            today = now.date()
-            hour = now.hour
-            
-            # Определяем день для публикации
-            if hour >= 18:
-                target_date = today + datetime.timedelta(days=1)
-                day_to_post = target_date.isoweekday()
-                
-                if day_to_post == 7:  # Воскресенье
-                    target_date += datetime.timedelta(days=1)
-                    day_to_post = 1
-                    day_name = "послезавтра (Понедельник)"
-                else:
-                    day_name = "завтра"
-            else:
-                target_date = today
-                day_to_post = today.isoweekday()
-                
-                if day_to_post == 7:  # Воскресенье
-                    target_date += datetime.timedelta(days=1)
-                    day_to_post = 1
-                    day_name = "завтра (Понедельник)"
-                else:
-                    day_name = "сегодня"
-            
-            # Получаем базовую четность
-            base_week_type = await get_current_week_type(pool)
-            
-            # ЕСЛИ ПОКАЗЫВАЕМ ПОНЕДЕЛЬНИК И СЕЙЧАС ВОСКРЕСЕНЬЕ - МЕНЯЕМ ЧЕТНОСТЬ
-            if day_to_post == 1 and (today.isoweekday() == 7 or (hour >= 18 and (today + datetime.timedelta(days=1)).isoweekday() == 7)):
-                week_type = 2 if base_week_type == 1 else 1
-                week_name = "нечетная" if week_type == 1 else "четная"
-                day_note = ""
-            else:
-                week_type = base_week_type
-                week_name = "нечетная" if week_type == 1 else "четная"
-                day_note = ""
-            
-            # Получаем расписание для конкретного чата
-            text = await get_rasp_formatted(day_to_post, week_type, chat_id, target_date)
-            
-            # Формируем сообщение
-            day_names = {
-                1: "Понедельник", 2: "Вторник", 3: "Среда",
-                4: "Четверг", 5: "Пятница", 6: "Суббота"
-            }
-            
-            if "(" in day_name and ")" in day_name:
-                msg = f"📅 Расписание на {day_name} | Неделя: {week_name}{day_note}\n\n{text}"
-            else:
-                msg = f"📅 Расписание на {day_name} ({day_names[day_to_post]}) | Неделя: {week_name}{day_note}\n\n{text}"
-            
-            # Добавляем анекдот
-            async with pool.acquire() as conn:
-                async with conn.cursor() as cur:
-                    await cur.execute("SELECT text FROM anekdoty ORDER BY RAND() LIMIT 1")
-                    row = await cur.fetchone()
-                    if row:
-                        msg += f"\n\n😂 Анекдот:\n{row[0]}"
-            
-            await bot.send_message(chat_id, msg)
-            
-        except Exception as e:
-            print(f"Ошибка отправки расписания в чат {chat_id}: {e}")
+        msg = f"{header}\n\n{texts[chat_id]}"
+        joke = await get_anekdot(pool, chat_id)
+        if joke:
+            msg += f"\n\n😂 Анекдот:\n{joke}"
+        messages[chat_id] = msg
+    
+    return messages
+
+async def deliver_publications(messages: dict) -> dict:
+    """Рассылает тексты по чатам параллельно, не больше PUBLISH_CONCURRENCY отправок одновременно.
+    
+    Возвращает {chat_id: message_id или исключение}.
+    """
+    results = await broadcast(
+        messages,
+        lambda chat_id: bot.send_message(chat_id, messages[chat_id]),
+        concurrency=PUBLISH_CONCURRENCY
+    )
+    
+    print(f"📤 Расписание отправлено в {len(delivered(results))}/{len(results)} чатов")
+    return results
+
+async def send_today_rasp():
+    try:
+        messages = await build_today_publications()
+    except Exception as e:
+        print(f"Ошибка подготовки расписания: {e}")
+        return {}
+    
+    return await deliver_publications(messages)
+
+# Заранее подготовленные публикации: (hour, minute) -> (версия модели, дата слота, {chat_id: message})
+prepared_publications = {}
+
+def _slot_datetime(hour: int, minute: int) -> datetime.datetime:
+    """Ближайший момент публикации для слота hour:minute"""
+    now = datetime.datetime.now(TZ)
+    slot = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if slot < now:
+        slot += datetime.timedelta(days=1)
+    return slot
+
+async def prerender_publication(hour: int, minute: int):
+    """Готовит тексты публикации слота заранее, чтобы в минуту публикации остались только отправки"""
+    slot = _slot_datetime(hour, minute)
+    try:
+        messages = await build_today_publications(slot)
+    except Exception as e:
+        print(f"Ошибка предварительной подготовки публикации {hour:02d}:{minute:02d}: {e}")
+        return
+    
+    prepared_publications[(hour, minute)] = (rasp_model.version, slot.date(), messages)
+    print(f"🗂 Публикация {hour:02d}:{minute:02d} подготовлена для {len(messages)} чатов")
+
+async def publish_slot(hour: int, minute: int):
+    prepared = prepared_publications.pop((hour, minute), None)
+    today = datetime.datetime.now(TZ).date()
+    
+    # Если расписание, ДЗ или четность менялись после подготовки - собираем заново
+    if prepared and prepared[0] == rasp_model.version and prepared[1] == today:
+        return await deliver_publications(prepared[2])
+    
+    return await send_today_rasp()
+
+async def send_week_digest():
+    """Воскресный дайджест: расписание наступающей недели в каждый чат"""
+    today = datetime.datetime.now(TZ).date()
+    week_start = today + datetime.timedelta(days=8 - today.isoweekday())
+    
+    base_week_type = await get_current_week_type(pool)
+    week_type = 2 if base_week_type == 1 else 1
+    
+    with bulk():
+        for chat_id in ALLOWED_CHAT_IDS:
+            try:
+                text = await get_week_formatted(chat_id, week_type, week_start, pool=pool)
+                await bot.send_message(chat_id, text)
+            except Exception as e:
+                print(f"Ошибка отправки расписания на неделю в чат {chat_id}: {e}")
 
 async def check_birthdays():
     print(f"🎂 [{datetime.datetime.now(TZ)}] Запуск проверки дней рождения...")
@@ -106,12 +174,13 @@ async def check_birthdays():
         
         message_text = f"🎉 С ДНЕМ РОЖДЕНИЯ, {user_name.upper()}! 🎉\n\nВ этом году тебе исполнилось {age} лет!\n\nПоздравляю! 🎂"
         
-        for chat_id in ALLOWED_CHAT_IDS:
-            try:
-                await bot.send_message(chat_id, message_text)
-                print(f"✅ Отправлено поздравление для {user_name} в чат {chat_id}")
-            except Exception as e:
-                print(f"❌ Ошибка отправки поздравления для {user_name} в чат {chat_id}: {e}")
+        with bulk():
+            for chat_id in ALLOWED_CHAT_IDS:
+                try:
+                    await bot.send_message(chat_id, message_text)
+                    print(f"✅ Отправлено поздравление для {user_name} в чат {chat_id}")
+                except Exception as e:
+                    print(f"❌ Ошибка отправки поздравления для {user_name} в чат {chat_id}: {e}")
     
     print("✅ Проверка дней рождения завершена")
     return True
\ No newline at end of file
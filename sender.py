@@ -0,0 +1,189 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+from config import SEND_GLOBAL_RATE, SEND_GROUP_PER_MINUTE, SEND_RETRY_ATTEMPTS, BROADCAST_CONCURRENCY
+
+# True внутри массовых рассылок: такие отправки пропускают интерактивные ответы вперёд
+bulk_sending = ContextVar("bulk_sending", default=False)
+
+# Методы Bot API, которые идут через общий темп и паузы RetryAfter
+LIMITED_METHOD_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+# Новые сообщения: только они идут в лимит SEND_GROUP_PER_MINUTE (правки - нет)
+GROUP_COUNTED_PREFIXES = ("Send", "Copy", "Forward")
+
+
+@contextmanager
+def bulk():
+    """Помечает отправки внутри блока как массовую рассылку"""
+    token = bulk_sending.set(True)
+    try:
+        yield
+    finally:
+        bulk_sending.reset(token)
+
+
+class SendScheduler:
+    """Общий темп исходящих сообщений.
+
+    - не больше SEND_GLOBAL_RATE сообщений в секунду на весь бот;
+    - не больше SEND_GROUP_PER_MINUTE сообщений в минуту в один групповой чат;
+    - массовые отправки ждут, пока есть ожидающие интерактивные;
+    - RetryAfter ставит на паузу только свой чат.
+    """
+
+    def __init__(self, global_rate: float, group_per_minute: int):
+        self.interval = 1.0 / global_rate
+        self.group_per_minute = group_per_minute
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+        # chat_id -> время отправок за последнюю минуту (только группы)
+        self._chat_sends = {}
+        # chat_id -> monotonic-время окончания паузы после RetryAfter
+        self._paused_until = {}
+        self._interactive_waiting = 0
+        self._interactive_idle = asyncio.Event()
+        self._interactive_idle.set()
+        self._last_cleanup = time.monotonic()
+
+    def pause(self, chat_id: int, seconds: float):
+        until = time.monotonic() + seconds
+        self._paused_until[chat_id] = max(self._paused_until.get(chat_id, 0.0), until)
+        print(f"⏳ Чат {chat_id} на паузе {seconds} с. по RetryAfter")
+
+    async def _wait_chat(self, chat_id: int, counted: bool):
+        counted = counted and chat_id < 0
+        while True:
+            now = time.monotonic()
+            wait = self._paused_until.get(chat_id, 0.0) - now
+
+            if counted:
+                sends = self._chat_sends.setdefault(chat_id, deque())
+                while sends and now - sends[0] >= 60:
+                    sends.popleft()
+                if len(sends) >= self.group_per_minute:
+                    wait = max(wait, sends[0] + 60 - now)
+
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+
+        self._paused_until.pop(chat_id, None)
+        if counted:
+            self._chat_sends[chat_id].append(time.monotonic())
+
+    async def _wait_global(self):
+        async with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def acquire(self, chat_id, is_bulk: bool, counted: bool = True):
+        self._cleanup()
+
+        # Ожидание своего чата (пауза, лимит группы) никого больше не задерживает
+        if chat_id is not None:
+            await self._wait_chat(chat_id, counted)
+
+        if is_bulk:
+            while self._interactive_waiting:
+                await self._interactive_idle.wait()
+            await self._wait_global()
+            return
+
+        # Приоритет интерактивных - только в общей очереди слотов
+        self._interactive_waiting += 1
+        self._interactive_idle.clear()
+        try:
+            await self._wait_global()
+        finally:
+            self._interactive_waiting -= 1
+            if not self._interactive_waiting:
+                self._interactive_idle.set()
+
+    def _cleanup(self):
+        """Раз в минуту удаляет состояние чатов, не писавших больше минуты"""
+        now = time.monotonic()
+        if now - self._last_cleanup < 60:
+            return
+        self._last_cleanup = now
+        for chat_id in [c for c, s in self._chat_sends.items() if not s or now - s[-1] >= 60]:
+            del self._chat_sends[chat_id]
+        for chat_id in [c for c, until in self._paused_until.items() if until <= now]:
+            del self._paused_until[chat_id]
+
+
+send_scheduler = SendScheduler(SEND_GLOBAL_RATE, SEND_GROUP_PER_MINUTE)
+
+
+class SendRateMiddleware(BaseRequestMiddleware):
+    """Пропускает исходящие сообщения бота через send_scheduler"""
+
+    async def __call__(self, make_request, bot, method):
+        method_name = type(method).__name__
+        if not method_name.startswith(LIMITED_METHOD_PREFIXES):
+            return await make_request(bot, method)
+        counted = method_name.startswith(GROUP_COUNTED_PREFIXES)
+
+        chat_id = getattr(method, "chat_id", None)
+        if not isinstance(chat_id, int):
+            chat_id = None
+
+        for attempt in range(SEND_RETRY_ATTEMPTS):
+            await send_scheduler.acquire(chat_id, bulk_sending.get(), counted)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == SEND_RETRY_ATTEMPTS - 1:
+                    raise
+                if chat_id is None:
+                    await asyncio.sleep(e.retry_after)
+                else:
+                    send_scheduler.pause(chat_id, e.retry_after)
+
+
+def _message_ids(sent):
+    if isinstance(sent, list):
+        return [m.message_id for m in sent]
+    # delete_messages/edit_* возвращают bool или Message
+    return getattr(sent, "message_id", sent)
+
+
+async def broadcast(chat_ids, send, concurrency: int = BROADCAST_CONCURRENCY,
+                    attempts: int = SEND_RETRY_ATTEMPTS) -> dict:
+    """Рассылает одно сообщение по чатам параллельно.
+
+    send(chat_id) - корутина отправки в один чат (send_message, copy_message,
+    send_media_group...). Сетевые и серверные ошибки повторяются до attempts раз.
+    Возвращает {chat_id: message_id (список id для альбома) или исключение}.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def deliver(chat_id):
+        async with semaphore:
+            for attempt in range(attempts):
+                try:
+                    return chat_id, _message_ids(await send(chat_id))
+                except (TelegramNetworkError, TelegramServerError) as e:
+                    if attempt == attempts - 1:
+                        print(f"Ошибка отправки в чат {chat_id}: {e}")
+                        return chat_id, e
+                    await asyncio.sleep(2 ** attempt)
+                except Exception as e:
+                    print(f"Ошибка отправки в чат {chat_id}: {e}")
+                    return chat_id, e
+
+    with bulk():
+        return dict(await asyncio.gather(*(deliver(chat_id) for chat_id in chat_ids)))
+
+
+def delivered(results: dict) -> dict:
+    """Только успешные доставки из результата broadcast"""
+    return {chat_id: result for chat_id, result in results.items() if not isinstance(result, Exception)}
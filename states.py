@@ -22,9 +22,15 @@ class AddSubjectState(StatesGroup):
 class DeleteTeacherMessageState(StatesGroup):
     message_id = State()
 
+class EditTeacherMessageState(StatesGroup):
+    text = State()
+
 class DeleteSubjectState(StatesGroup):
     subject_choice = State()
 
+class ImportAnekdotyState(StatesGroup):
+    file = State()
+
 class AddSpecialUserState(StatesGroup):
     user_id = State()
     signature = State()